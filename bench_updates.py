@@ -0,0 +1,294 @@
+"""
+🏁 Бенчмарк приёма апдейтов "Бесконечная гача": вебхук против поллинга
+Поднимает локальную заглушку Bot API, прогоняет одни и те же
+синтетические нажатия кнопок через настоящий диспетчер бота
+(во временной БД) и меряет пропускную способность и задержку.
+
+    python bench_updates.py --updates 5000 --users 200 --mode both
+"""
+import argparse
+import asyncio
+import os
+import random
+import socket
+import tempfile
+import time
+
+os.environ.setdefault("BOT_TOKEN", "42:BENCH")
+os.environ.setdefault("WEBHOOK_SECRET", "bench")
+
+from aiohttp import ClientSession, web
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.enums import ParseMode
+
+import config
+import database as db
+import gacha_bot
+from outbound import SendQueue
+
+# Кнопки, которые жмут синтетические игроки
+CALLBACKS = ["menu", "profile", "collection", "quests", "top", "pull", "pull_free"]
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def make_update(update_id: int, user_id: int, data: str) -> dict:
+    user = {"id": user_id, "is_bot": False, "first_name": f"Игрок {user_id}"}
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": user,
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": 1,
+                "date": 0,
+                "chat": {"id": user_id, "type": "private"},
+                "text": "🎰",
+            },
+        },
+    }
+
+
+class FakeBotAPI:
+    """
+    Заглушка Bot API: отвечает на все методы и раздаёт апдейты через getUpdates.
+    flood — доля запросов в чаты, на которые она отвечает 429.
+    """
+
+    def __init__(self, flood: float = 0.0, seed: int = 0):
+        self.updates: list = []
+        self.calls = 0
+        self.flood = flood
+        self._rnd = random.Random(seed)
+        self._new_updates = asyncio.Event()
+        self.port = _free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self._runner = None
+
+    def push(self, updates: list):
+        self.updates.extend(updates)
+        self._new_updates.set()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.calls += 1
+        method = request.match_info["method"].lower()
+        params = await request.post()
+        if "chat_id" in params and self._rnd.random() < self.flood:
+            return web.json_response({
+                "ok": False, "error_code": 429,
+                "description": "Too Many Requests: retry after 1",
+                "parameters": {"retry_after": 1},
+            })
+        if method == "getme":
+            result = {"id": 42, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        elif method == "getupdates":
+            result = await self._get_updates(params)
+        elif method == "sendmessage":
+            chat_id = int(params.get("chat_id", 0))
+            result = {"message_id": 1, "date": 0, "chat": {"id": chat_id, "type": "private"}}
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def _get_updates(self, params) -> list:
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        self.updates = [u for u in self.updates if u["update_id"] >= offset]
+        if not self.updates:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout=min(float(params.get("timeout") or 0), 1))
+            except asyncio.TimeoutError:
+                return []
+        return self.updates[:limit]
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "127.0.0.1", self.port).start()
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+
+class ProcessedCounter(BaseMiddleware):
+    """Считает обработанные апдейты и время от отправки до конца обработки"""
+
+    def __init__(self):
+        self.reset(0)
+
+    def reset(self, expected: int):
+        self.expected = expected
+        self.sent_at: dict = {}
+        self.latencies: list = []
+        self.done = asyncio.Event()
+
+    async def __call__(self, handler, event, data):
+        try:
+            return await handler(event, data)
+        finally:
+            self.latencies.append(time.perf_counter() - self.sent_at.get(event.update_id, 0))
+            if len(self.latencies) >= self.expected:
+                self.done.set()
+
+
+def _percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+def _report(mode: str, counter: ProcessedCounter, seconds: float) -> dict:
+    return {
+        "mode": mode,
+        "updates": len(counter.latencies),
+        "seconds": round(seconds, 3),
+        "updates_per_sec": round(len(counter.latencies) / seconds, 1),
+        "latency_p50_ms": round(_percentile(counter.latencies, 0.5) * 1000, 1),
+        "latency_p95_ms": round(_percentile(counter.latencies, 0.95) * 1000, 1),
+    }
+
+
+async def bench_polling(bot: Bot, api: FakeBotAPI, counter: ProcessedCounter, updates: list) -> dict:
+    dp = gacha_bot.dp
+    counter.reset(len(updates))
+    started = time.perf_counter()
+    for u in updates:
+        counter.sent_at[u["update_id"]] = started
+    api.push(updates)
+    task = asyncio.create_task(dp.start_polling(bot, handle_signals=False, close_bot_session=False))
+    await counter.done.wait()
+    seconds = time.perf_counter() - started
+    await dp.stop_polling()
+    await task
+    return _report("polling", counter, seconds)
+
+
+async def bench_webhook(bot: Bot, counter: ProcessedCounter, updates: list, connections: int) -> dict:
+    port = _free_port()
+    runner = web.AppRunner(gacha_bot.build_webhook_app(bot))
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    url = f"http://127.0.0.1:{port}{config.WEBHOOK_PATH}"
+    headers = {"X-Telegram-Bot-Api-Secret-Token": config.WEBHOOK_SECRET}
+
+    counter.reset(len(updates))
+    queue = list(reversed(updates))
+
+    async def sender(session: ClientSession):
+        # Как Telegram: не больше connections запросов одновременно
+        while queue:
+            update = queue.pop()
+            counter.sent_at[update["update_id"]] = time.perf_counter()
+            async with session.post(url, json=update, headers=headers) as resp:
+                resp.raise_for_status()
+
+    started = time.perf_counter()
+    try:
+        async with ClientSession() as session:
+            await asyncio.gather(*(sender(session) for _ in range(connections)))
+        await counter.done.wait()
+        seconds = time.perf_counter() - started
+    finally:
+        await runner.cleanup()
+    return _report("webhook", counter, seconds)
+
+
+def format_report(r: dict) -> str:
+    s = r["send"]
+    return (
+        f"{r['mode']:<8} {r['updates']} апдейтов за {r['seconds']} с — {r['updates_per_sec']} апд./с, "
+        f"задержка p50 {r['latency_p50_ms']} мс, p95 {r['latency_p95_ms']} мс\n"
+        f"         отправлено {s['sent']}, 429 {s['retries']}, ошибок {s['failed']}, "
+        f"ожидание в очереди ср. {s['wait_avg_ms']} мс / макс. {s['wait_max_ms']} мс\n"
+        f"         двойных нажатий схлопнуто {r['users']['coalesced']}, отброшено {r['users']['dropped']}"
+    )
+
+
+async def run(args):
+    rnd = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DATABASE_PATH = os.path.join(tmp, "bench.db")
+        await db.init_db()
+        for user_id in range(1, args.users + 1):
+            await db.create_player(user_id, f"user{user_id}", f"Игрок {user_id}")
+
+        api = FakeBotAPI(args.flood, args.seed)
+        await api.start()
+        counter = ProcessedCounter()
+        # Счётчик — раньше сериализатора игроков, чтобы видеть и отброшенные двойные нажатия
+        outer = gacha_bot.dp.update.outer_middleware
+        outer.unregister(gacha_bot.user_serializer)
+        outer.unregister(gacha_bot.update_limiter)
+        outer(counter)
+        outer(gacha_bot.user_serializer)
+        outer(gacha_bot.update_limiter)
+        gacha_bot.reservoir.start()
+        # По умолчанию без лимитов Telegram — меряем сам приём апдейтов
+        if args.limits:
+            send_queue = gacha_bot.send_queue
+        else:
+            send_queue = SendQueue(global_rate=None, chat_rate=None, group_rate=None,
+                                   workers=config.SEND_WORKERS, max_retries=config.SEND_MAX_RETRIES)
+        send_queue.start()
+
+        results = []
+        try:
+            for mode in ("polling", "webhook"):
+                if args.mode not in (mode, "both"):
+                    continue
+                offset = len(results) * args.updates
+                updates = [
+                    make_update(offset + n + 1, rnd.randint(1, args.users), rnd.choice(CALLBACKS))
+                    for n in range(args.updates)
+                ]
+                # Каждый прогон — со своей сессией: вебхук закрывает её при остановке
+                bot = Bot(
+                    token=config.BOT_TOKEN,
+                    session=AiohttpSession(api=TelegramAPIServer.from_base(api.url)),
+                    default=DefaultBotProperties(parse_mode=ParseMode.HTML),
+                )
+                bot.session.middleware(send_queue)
+                if mode == "polling":
+                    result = await bench_polling(bot, api, counter, updates)
+                    await bot.session.close()
+                else:
+                    result = await bench_webhook(bot, counter, updates, args.connections)
+                result["send"] = send_queue.stats()
+                result["users"] = gacha_bot.user_serializer.stats()
+                results.append(result)
+                print(format_report(result), flush=True)
+        finally:
+            await send_queue.stop()
+            await gacha_bot.reservoir.stop()
+            await api.stop()
+            await db.close_db()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пропускная способность вебхука и поллинга на синтетических апдейтах")
+    parser.add_argument("--updates", type=int, default=2000, help="апдейтов на каждый режим")
+    parser.add_argument("--users", type=int, default=100, help="сколько разных игроков жмут кнопки")
+    parser.add_argument("--mode", choices=["polling", "webhook", "both"], default="both")
+    parser.add_argument("--connections", type=int, default=config.WEBHOOK_MAX_CONNECTIONS,
+                        help="параллельных запросов к вебхуку (как max_connections у Telegram)")
+    parser.add_argument("--limits", action="store_true", help="с лимитами отправки из config")
+    parser.add_argument("--flood", type=float, default=0.0, help="доля ответов 429 от заглушки API")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
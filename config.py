@@ -15,6 +15,67 @@ except ValueError:
 
 DATABASE_PATH = "gacha_bot.db"
 
+# Получение апдейтов: "polling" или "webhook"
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Вебхук: публичный адрес (https://example.com), путь и секрет заголовка (обязателен)
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+# Где слушает встроенный aiohttp-сервер
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", os.getenv("PORT", "8080")))
+# Сколько параллельных соединений к вебхуку открывает Telegram (1–100)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+# Сколько апдейтов обрабатывается одновременно (в обоих режимах)
+UPDATES_CONCURRENCY = int(os.getenv("UPDATES_CONCURRENCY", "100"))
+# Сколько апдейтов одного игрока может ждать обработки; лишние отбрасываются
+USER_MAX_PENDING = int(os.getenv("USER_MAX_PENDING", "3"))
+
+# Метрики в формате Prometheus: отдельный сервер с /metrics (порт 0 — выключен)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+
+# Журнал медленных запросов: порог (мс, 0 — выключен), сводка топ-N раз в интервал (сек.)
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+SLOW_QUERY_TOP = int(os.getenv("SLOW_QUERY_TOP", "10"))
+SLOW_QUERY_SUMMARY_INTERVAL = float(os.getenv("SLOW_QUERY_SUMMARY_INTERVAL", "600"))
+
+# Номер воркера генератора ID предметов (0–1023, уникален для каждого процесса)
+ITEM_ID_WORKER = int(os.getenv("ITEM_ID_WORKER", "0"))
+
+# Пул соединений: один писатель + N читателей
+DB_READERS = int(os.getenv("DB_READERS", "4"))
+
+# Кэш недавно открытых предметов (ключ — игрок + id предмета)
+ITEM_CACHE_SIZE = 2048
+
+# Сколько секунд держать ответ лидерборда
+LEADERBOARD_CACHE_TTL = 5
+
+# Кэш строк игроков (обновляется при каждой записи)
+PLAYER_CACHE_SIZE = 10000
+PLAYER_CACHE_TTL = 300
+
+# Резерв заранее сгенерированных тяг: сколько держать для каждого пака
+RESERVOIR_SIZES = {
+    "single_free": 500,
+    "single_premium": 200,
+    "pack_10": 100,
+    "pack_50": 20,
+    "pack_100": 10,
+}
+# Пополнение: до RESERVOIR_REFILL_BATCH тяг пака раз в RESERVOIR_REFILL_INTERVAL сек.
+RESERVOIR_REFILL_BATCH = int(os.getenv("RESERVOIR_REFILL_BATCH", "20"))
+RESERVOIR_REFILL_INTERVAL = float(os.getenv("RESERVOIR_REFILL_INTERVAL", "0.5"))
+
+# Исходящая очередь: лимиты Telegram (запросов в секунду) и повторы после 429
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "30"))
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", "1"))
+SEND_CHAT_BURST = int(os.getenv("SEND_CHAT_BURST", "3"))
+SEND_GROUP_RATE = 20 / 60
+SEND_WORKERS = int(os.getenv("SEND_WORKERS", "8"))
+SEND_MAX_RETRIES = 3
+
 # Ежедневные бесплатные тяги
 DAILY_FREE_PULLS = 3
 
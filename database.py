@@ -1,123 +1,532 @@
 """
 🗄 База данных "Бесконечная гача"
 """
+import asyncio
+import hashlib
+import time
 import aiosqlite
-import json
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
-from config import DATABASE_PATH
+from cache import LRUCache
+from config import (
+    DATABASE_PATH, DB_READERS,
+    ITEM_CACHE_SIZE, LEADERBOARD_CACHE_TTL, PLAYER_CACHE_SIZE, PLAYER_CACHE_TTL,
+    SLOW_QUERY_MS, SLOW_QUERY_TOP,
+)
+from gacha_data import (
+    GACHA_PACKS, RARITIES, THEMES, Item, gacha_pull, get_quest_events,
+    pack_item_count, pull_stream, pull_stream_seed,
+)
+from gacha_data import get_collection_stats as calc_collection_stats
+from metrics import DB_POOL_WAIT, DB_QUERY_ERRORS, DB_QUERY_LATENCY, DB_SLOW_QUERIES
+from quests import QuestBook
+from slow_queries import SlowQueryLog, many_shape, params_shape
+
+
+# ======== ИНСТРУМЕНТИРОВАНИЕ ========
+# Длина метки запроса в метриках; длинный запрос сокращается до начала и конца
+QUERY_LABEL_LENGTH = 80
+QUERY_LABEL_HEAD = 36
+QUERY_LABEL_TAIL = 28
+
+_query_labels = LRUCache(maxsize=1024)
+# Запросы дольше порога; сводку по ним запускает бот (slow_log.start)
+slow_log = SlowQueryLog(SLOW_QUERY_MS / 1000, SLOW_QUERY_TOP)
+
+
+def query_label(sql: str) -> str:
+    """
+    Метка запроса для метрик: текст в одну строку. Длинный сокращается
+    до начала и конца (там WHERE/ORDER BY) плюс короткий хеш всего текста —
+    запросы с общим началом (_ITEM_SELECT) не сливаются в одну серию.
+    """
+    label = _query_labels.get(sql)
+    if label is None:
+        text = " ".join(sql.split())
+        if len(text) <= QUERY_LABEL_LENGTH:
+            label = text
+        else:
+            digest = hashlib.blake2b(text.encode(), digest_size=3).hexdigest()
+            label = f"{text[:QUERY_LABEL_HEAD]} … {text[-QUERY_LABEL_TAIL:]} #{digest}"
+        _query_labels.put(sql, label)
+    return label
+
+
+def _observe_query(sql: str, seconds: float, failed: bool = False):
+    label = query_label(sql)
+    DB_QUERY_LATENCY.observe(seconds, label)
+    if failed:
+        DB_QUERY_ERRORS.inc(label)
+
+
+def _timed_call(fn, *args):
+    """Выполняется в потоке соединения aiosqlite: замеряет только сам SQLite"""
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+async def _run_timed(conn: aiosqlite.Connection, fn, *args):
+    """
+    Вызов sqlite3 в потоке соединения с замером там же. Снаружи, вокруг
+    await, в замер попали бы очередь потока и задержка цикла событий —
+    и поиск по первичному ключу под нагрузкой выглядел бы медленным.
+    Опирается на Connection._execute: так же aiosqlite выполняет execute().
+    """
+    return await conn._execute(_timed_call, fn, *args)
+
+
+class _TimedConnection:
+    """
+    Обёртка соединения из пула: execute/executemany замеряются
+    и попадают в метрики, медленные — ещё и в slow_log с планом.
+    Замеряется выполнение в SQLite, без ожидания в очереди потока;
+    у SELECT это первый шаг (агрегаты и сортировка целиком), а не
+    последующий fetch. Остальное передаётся соединению как есть.
+    """
+
+    __slots__ = ("_conn",)
+
+    def __init__(self, conn: aiosqlite.Connection):
+        self._conn = conn
+
+    async def execute(self, sql: str, parameters=None):
+        started = time.perf_counter()
+        try:
+            cursor, seconds = await _run_timed(self._conn, self._conn._conn.execute, sql, parameters or ())
+        except Exception:
+            _observe_query(sql, time.perf_counter() - started, failed=True)
+            raise
+        _observe_query(sql, seconds)
+        if slow_log.is_slow(seconds):
+            await self._log_slow(sql, seconds, params_shape(parameters), parameters)
+        return aiosqlite.Cursor(self._conn, cursor)
+
+    async def executemany(self, sql: str, parameters):
+        started = time.perf_counter()
+        try:
+            cursor, seconds = await _run_timed(self._conn, self._conn._conn.executemany, sql, parameters)
+        except Exception:
+            _observe_query(sql, time.perf_counter() - started, failed=True)
+            raise
+        _observe_query(sql, seconds)
+        if slow_log.is_slow(seconds):
+            # План — по первой строке параметров, если они не генератор
+            first = parameters[0] if isinstance(parameters, (list, tuple)) and parameters else None
+            await self._log_slow(sql, seconds, many_shape(parameters), first)
+        return aiosqlite.Cursor(self._conn, cursor)
+
+    async def _log_slow(self, sql: str, seconds: float, shape: str, parameters):
+        plan = None
+        if slow_log.needs_plan(sql):
+            try:
+                cur = await self._conn.execute("EXPLAIN QUERY PLAN " + sql, parameters)
+                plan = [row[3] for row in await cur.fetchall()]
+            except aiosqlite.Error as e:
+                plan = [f"план не получен: {e}"]
+        label = query_label(sql)
+        DB_SLOW_QUERIES.inc(label)
+        slow_log.record(sql, label, seconds, shape, plan)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+# ======== ПУЛ СОЕДИНЕНИЙ ========
+class ConnectionPool:
+    """
+    Долгоживущие соединения с БД: один писатель и N читателей.
+    Писатель сериализуется блокировкой — каждая транзакция целиком
+    выполняется на нём и коммитится при выходе из блока.
+    """
+
+    def __init__(self, path: str, readers: int = 4):
+        self.path = path
+        self.readers_count = max(1, readers)
+        self._writer: aiosqlite.Connection | None = None
+        self._write_lock = asyncio.Lock()
+        self._readers: asyncio.Queue = asyncio.Queue()
+        self._all: list[aiosqlite.Connection] = []
+
+    async def _connect(self) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(self.path)
+        conn.row_factory = aiosqlite.Row
+        await conn.execute("PRAGMA busy_timeout=5000")
+        self._all.append(conn)
+        return conn
+
+    async def open(self):
+        self._writer = await self._connect()
+        # WAL: читатели не блокируются писателем
+        await self._writer.execute("PRAGMA journal_mode=WAL")
+        for _ in range(self.readers_count):
+            self._readers.put_nowait(await self._connect())
+
+    async def close(self):
+        for conn in self._all:
+            await conn.close()
+        self._all.clear()
+        self._writer = None
+        self._readers = asyncio.Queue()
+
+    @asynccontextmanager
+    async def reader(self):
+        with DB_POOL_WAIT.time("reader"):
+            conn = await self._readers.get()
+        try:
+            yield _TimedConnection(conn)
+        finally:
+            self._readers.put_nowait(conn)
+
+    @asynccontextmanager
+    async def writer(self):
+        with DB_POOL_WAIT.time("writer"):
+            await self._write_lock.acquire()
+        try:
+            try:
+                yield _TimedConnection(self._writer)
+            except BaseException:
+                await self._writer.rollback()
+                raise
+            _, seconds = await _run_timed(self._writer, self._writer._conn.commit)
+            _observe_query("COMMIT", seconds)
+        finally:
+            self._write_lock.release()
+
+
+_pool: ConnectionPool | None = None
+
+# Предметы не меняются после выдачи — недавно открытые можно держать в памяти
+_item_cache = LRUCache(maxsize=ITEM_CACHE_SIZE)
+_leaderboard_cache = LRUCache(maxsize=8, ttl=LEADERBOARD_CACHE_TTL)
+# Все записи в players идут через этот модуль и обновляют кэш; TTL — страховка
+_player_cache = LRUCache(maxsize=PLAYER_CACHE_SIZE, ttl=PLAYER_CACHE_TTL)
+# Квесты игрока на день: (user_id, дата) -> QuestBook; пишутся тоже только здесь
+_quest_cache = LRUCache(maxsize=PLAYER_CACHE_SIZE)
+
+
+def _get_pool() -> ConnectionPool:
+    if _pool is None:
+        raise RuntimeError("БД не инициализирована: вызовите init_db()")
+    return _pool
+
+
+def _reader():
+    return _get_pool().reader()
+
+
+def _writer():
+    return _get_pool().writer()
+
+
+async def close_db():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+# ======== СХЕМА И МИГРАЦИИ ========
+async def _create_schema(db):
+    """Базовая схема (версия 0) — для новой или старой, неверсионной БД"""
+    await db.execute("""CREATE TABLE IF NOT EXISTS players (
+        user_id INTEGER PRIMARY KEY,
+        username TEXT DEFAULT '',
+        first_name TEXT DEFAULT '',
+        gold INTEGER DEFAULT 1000,
+        stars INTEGER DEFAULT 0,
+        free_pulls_today INTEGER DEFAULT 0,
+        free_pulls_reset_date TEXT DEFAULT '',
+        total_pulls INTEGER DEFAULT 0,
+        referrer_id INTEGER,
+        daily_streak INTEGER DEFAULT 0,
+        last_daily TEXT DEFAULT '',
+        joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )""")
+    
+    await db.execute("""CREATE TABLE IF NOT EXISTS collection (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        unique_id TEXT UNIQUE,
+        name TEXT,
+        description TEXT,
+        rarity TEXT,
+        theme TEXT,
+        theme_name TEXT,
+        power INTEGER DEFAULT 0,
+        luck REAL DEFAULT 0,
+        magic INTEGER DEFAULT 0,
+        special_effects TEXT,
+        obtained_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES players(user_id)
+    )""")
+    
+    await db.execute("""CREATE TABLE IF NOT EXISTS quests (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        quest_type TEXT,
+        description TEXT,
+        target INTEGER,
+        progress INTEGER DEFAULT 0,
+        reward_gold INTEGER DEFAULT 0,
+        reward_stars INTEGER DEFAULT 0,
+        is_completed INTEGER DEFAULT 0,
+        is_claimed INTEGER DEFAULT 0,
+        date TEXT,
+        FOREIGN KEY (user_id) REFERENCES players(user_id)
+    )""")
+
+
+async def _migrate_001_indexes(db):
+    """Индексы под горячие запросы коллекции, квестов и рефералов"""
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_collection_user_obtained ON collection(user_id, obtained_at)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_quests_user_date_type ON quests(user_id, date, quest_type)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_players_referrer ON players(referrer_id)")
+
+
+async def _migrate_002_collection_stats(db):
+    """Агрегаты коллекции, поддерживаемые при каждой вставке"""
+    rarity_columns = ",\n        ".join(f"{r} INTEGER DEFAULT 0" for r in RARITIES)
+    await db.execute(f"""CREATE TABLE IF NOT EXISTS collection_stats (
+        user_id INTEGER PRIMARY KEY,
+        total INTEGER DEFAULT 0,
+        total_power INTEGER DEFAULT 0,
+        total_luck REAL DEFAULT 0,
+        total_magic INTEGER DEFAULT 0,
+        {rarity_columns}
+    )""")
+    await db.execute("""CREATE TABLE IF NOT EXISTS collection_theme_stats (
+        user_id INTEGER,
+        theme TEXT,
+        count INTEGER DEFAULT 0,
+        PRIMARY KEY (user_id, theme)
+    ) WITHOUT ROWID""")
+    await _rebuild_collection_stats(db)
+
+
+async def _migrate_003_leaderboard(db):
+    """Размер коллекции в players + индекс под топ и позицию игрока"""
+    await db.execute("ALTER TABLE players ADD COLUMN collection_size INTEGER DEFAULT 0")
+    await db.execute("""UPDATE players SET collection_size=COALESCE(
+        (SELECT total FROM collection_stats WHERE collection_stats.user_id=players.user_id), 0)""")
+    await db.execute("""CREATE INDEX IF NOT EXISTS idx_players_leaderboard
+        ON players(collection_size DESC, total_pulls DESC)""")
+
+
+def _hex_to_int(value):
+    try:
+        return int(value, 16)
+    except (TypeError, ValueError):
+        return None
+
+
+async def _migrate_004_integer_unique_id(db):
+    """
+    unique_id становится INTEGER (Snowflake-ID). Старые 12-символьные hex-ID
+    переводятся в числа < 2^48 и не пересекаются с новыми.
+    """
+    await db.create_function("hex_to_int", 1, _hex_to_int, deterministic=True)
+    await db.execute("""CREATE TABLE collection_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        unique_id INTEGER UNIQUE,
+        name TEXT,
+        description TEXT,
+        rarity TEXT,
+        theme TEXT,
+        theme_name TEXT,
+        power INTEGER DEFAULT 0,
+        luck REAL DEFAULT 0,
+        magic INTEGER DEFAULT 0,
+        special_effects TEXT,
+        obtained_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES players(user_id)
+    )""")
+    await db.execute("""INSERT INTO collection_new
+        (id, user_id, unique_id, name, description, rarity, theme, theme_name,
+         power, luck, magic, special_effects, obtained_at)
+        SELECT id, user_id, hex_to_int(unique_id), name, description, rarity, theme, theme_name,
+         power, luck, magic, special_effects, obtained_at
+        FROM collection""")
+    await db.execute("DROP TABLE collection")
+    await db.execute("ALTER TABLE collection_new RENAME TO collection")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_collection_user_obtained ON collection(user_id, obtained_at)")
+
+
+async def _migrate_005_seed_storage(db):
+    """
+    Предмет хранится как (seed, rarity, theme) — остальное выводится заново
+    через gacha_data.item_from_seed. У старых предметов seed нет, поэтому их
+    текстовые поля переезжают в collection_legacy и читаются оттуда.
+    """
+    await db.execute("""CREATE TABLE IF NOT EXISTS collection_legacy (
+        id INTEGER PRIMARY KEY,
+        name TEXT,
+        description TEXT,
+        theme_name TEXT,
+        power INTEGER DEFAULT 0,
+        luck REAL DEFAULT 0,
+        magic INTEGER DEFAULT 0,
+        special_effects TEXT
+    )""")
+    await db.execute("""INSERT INTO collection_legacy
+        (id, name, description, theme_name, power, luck, magic, special_effects)
+        SELECT id, name, description, theme_name, power, luck, magic, special_effects
+        FROM collection""")
+    await db.execute("""CREATE TABLE collection_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        unique_id INTEGER UNIQUE,
+        seed INTEGER,
+        rarity TEXT,
+        theme TEXT,
+        obtained_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES players(user_id)
+    )""")
+    await db.execute("""INSERT INTO collection_new (id, user_id, unique_id, rarity, theme, obtained_at)
+        SELECT id, user_id, unique_id, rarity, theme, obtained_at FROM collection""")
+    await db.execute("DROP TABLE collection")
+    await db.execute("ALTER TABLE collection_new RENAME TO collection")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_collection_user_obtained ON collection(user_id, obtained_at)")
+
+
+async def _migrate_006_pull_log(db):
+    """Счётчик тяг игрока и журнал тяг с seed'ом потока для воспроизведения"""
+    await db.execute("ALTER TABLE players ADD COLUMN pull_counter INTEGER DEFAULT 0")
+    await db.execute("""CREATE TABLE IF NOT EXISTS pulls (
+        user_id INTEGER,
+        pull_no INTEGER,
+        pack_id TEXT,
+        stream_seed INTEGER,
+        item_count INTEGER,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (user_id, pull_no)
+    ) WITHOUT ROWID""")
+
+
+# Порядок важен: миграция N переводит схему в версию N (PRAGMA user_version)
+MIGRATIONS = [
+    _migrate_001_indexes,
+    _migrate_002_collection_stats,
+    _migrate_003_leaderboard,
+    _migrate_004_integer_unique_id,
+    _migrate_005_seed_storage,
+    _migrate_006_pull_log,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
 
 
 async def init_db():
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute("""CREATE TABLE IF NOT EXISTS players (
-            user_id INTEGER PRIMARY KEY,
-            username TEXT DEFAULT '',
-            first_name TEXT DEFAULT '',
-            gold INTEGER DEFAULT 1000,
-            stars INTEGER DEFAULT 0,
-            free_pulls_today INTEGER DEFAULT 0,
-            free_pulls_reset_date TEXT DEFAULT '',
-            total_pulls INTEGER DEFAULT 0,
-            referrer_id INTEGER,
-            daily_streak INTEGER DEFAULT 0,
-            last_daily TEXT DEFAULT '',
-            joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )""")
-        
-        await db.execute("""CREATE TABLE IF NOT EXISTS collection (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            unique_id TEXT UNIQUE,
-            name TEXT,
-            description TEXT,
-            rarity TEXT,
-            theme TEXT,
-            theme_name TEXT,
-            power INTEGER DEFAULT 0,
-            luck REAL DEFAULT 0,
-            magic INTEGER DEFAULT 0,
-            special_effects TEXT,
-            obtained_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES players(user_id)
-        )""")
+    global _pool
+    if _pool is None:
+        _pool = ConnectionPool(DATABASE_PATH, DB_READERS)
+        await _pool.open()
+    
+    async with _writer() as db:
+        cur = await db.execute("PRAGMA user_version")
+        version = (await cur.fetchone())[0]
+        if version >= SCHEMA_VERSION:
+            return
         
-        await db.execute("""CREATE TABLE IF NOT EXISTS quests (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            quest_type TEXT,
-            description TEXT,
-            target INTEGER,
-            progress INTEGER DEFAULT 0,
-            reward_gold INTEGER DEFAULT 0,
-            reward_stars INTEGER DEFAULT 0,
-            is_completed INTEGER DEFAULT 0,
-            is_claimed INTEGER DEFAULT 0,
-            date TEXT,
-            FOREIGN KEY (user_id) REFERENCES players(user_id)
-        )""")
+        if version == 0:
+            await _create_schema(db)
         
-        await db.commit()
+        # Каждая миграция — отдельная транзакция вместе с новой версией
+        for number in range(version + 1, SCHEMA_VERSION + 1):
+            await db.execute("BEGIN")
+            await MIGRATIONS[number - 1](db)
+            await db.execute(f"PRAGMA user_version={number}")
+            await db.commit()
 
 
 # ======== ИГРОКИ ========
+def _cache_player(row):
+    """Кладёт свежую строку игрока (из RETURNING *) в кэш — только после коммита"""
+    if row:
+        _player_cache.put(row["user_id"], dict(row))
+
+
+def get_player_cache_stats() -> dict:
+    return _player_cache.stats()
+
+
 async def get_player(user_id: int) -> dict | None:
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
+    """Строка игрока; горячие игроки отдаются из кэша (не изменяйте словарь)"""
+    player = _player_cache.get(user_id)
+    if player is not None:
+        return player
+    async with _reader() as db:
         cur = await db.execute("SELECT * FROM players WHERE user_id = ?", (user_id,))
         row = await cur.fetchone()
-        return dict(row) if row else None
+    if not row:
+        return None
+    # Пока мы читали, писатель мог положить более свежую строку — она главнее
+    fresher = _player_cache.get(user_id)
+    if fresher is not None:
+        return fresher
+    player = dict(row)
+    _player_cache.put(user_id, player)
+    return player
 
 
 async def create_player(user_id: int, username: str, first_name: str, referrer_id: int = None):
     from config import START_GOLD, START_STARS
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with _writer() as db:
         await db.execute("""INSERT OR IGNORE INTO players 
             (user_id, username, first_name, gold, stars, referrer_id) 
             VALUES (?, ?, ?, ?, ?, ?)""",
             (user_id, username, first_name, START_GOLD, START_STARS, referrer_id))
-        await db.commit()
+    _player_cache.pop(user_id)
 
 
 async def update_player_name(user_id: int, username: str, first_name: str):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute("UPDATE players SET username=?, first_name=? WHERE user_id=?",
+    async with _writer() as db:
+        cur = await db.execute("UPDATE players SET username=?, first_name=? WHERE user_id=? RETURNING *",
             (username, first_name, user_id))
-        await db.commit()
+        row = await cur.fetchone()
+    _cache_player(row)
 
 
 # ======== РЕСУРСЫ ========
 async def add_gold(user_id: int, amount: int):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute("UPDATE players SET gold=gold+? WHERE user_id=?", (amount, user_id))
-        await db.commit()
+    async with _writer() as db:
+        cur = await db.execute("UPDATE players SET gold=gold+? WHERE user_id=? RETURNING *", (amount, user_id))
+        row = await cur.fetchone()
+    _cache_player(row)
 
 
 async def add_stars(user_id: int, amount: int):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute("UPDATE players SET stars=stars+? WHERE user_id=?", (amount, user_id))
-        await db.commit()
+    async with _writer() as db:
+        cur = await db.execute("UPDATE players SET stars=stars+? WHERE user_id=? RETURNING *", (amount, user_id))
+        row = await cur.fetchone()
+    _cache_player(row)
+
+
+async def _debit(db, user_id: int, gold: int = 0, stars: int = 0, pulls: int = 0):
+    """
+    Атомарно списывает валюту одним UPDATE: условие в WHERE не даёт уйти в минус
+    даже при параллельных покупках. Возвращает новую строку игрока или None.
+    """
+    cur = await db.execute("""UPDATE players SET gold=gold-?, stars=stars-?, total_pulls=total_pulls+?
+        WHERE user_id=? AND gold>=? AND stars>=? RETURNING *""",
+        (gold, stars, pulls, user_id, gold, stars))
+    return await cur.fetchone()
+
+
+async def spend(user_id: int, gold: int = 0, stars: int = 0) -> bool:
+    """Списывает золото и/или Stars разом — всё или ничего"""
+    async with _writer() as db:
+        row = await _debit(db, user_id, gold=gold, stars=stars)
+    _cache_player(row)
+    return row is not None
 
 
 async def spend_gold(user_id: int, amount: int) -> bool:
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        cur = await db.execute("SELECT gold FROM players WHERE user_id=?", (user_id,))
-        row = await cur.fetchone()
-        if not row or row[0] < amount:
-            return False
-        await db.execute("UPDATE players SET gold=gold-? WHERE user_id=?", (amount, user_id))
-        await db.commit()
-        return True
+    return await spend(user_id, gold=amount)
 
 
 async def spend_stars(user_id: int, amount: int) -> bool:
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        cur = await db.execute("SELECT stars FROM players WHERE user_id=?", (user_id,))
-        row = await cur.fetchone()
-        if not row or row[0] < amount:
-            return False
-        await db.execute("UPDATE players SET stars=stars-? WHERE user_id=?", (amount, user_id))
-        await db.commit()
-        return True
+    return await spend(user_id, stars=amount)
 
 
 # ======== БЕСПЛАТНЫЕ ТЯГИ ========
@@ -129,146 +538,282 @@ async def get_free_pulls_left(user_id: int) -> int:
     
     today = datetime.now().strftime("%Y-%m-%d")
     if player["free_pulls_reset_date"] != today:
-        async with aiosqlite.connect(DATABASE_PATH) as db:
-            await db.execute("UPDATE players SET free_pulls_today=0, free_pulls_reset_date=? WHERE user_id=?",
-                (today, user_id))
-            await db.commit()
+        async with _writer() as db:
+            cur = await db.execute("""UPDATE players SET free_pulls_today=0, free_pulls_reset_date=?
+                WHERE user_id=? RETURNING *""", (today, user_id))
+            row = await cur.fetchone()
+        _cache_player(row)
         return DAILY_FREE_PULLS
     
     return max(0, DAILY_FREE_PULLS - player["free_pulls_today"])
 
 
 async def use_free_pull(user_id: int):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute("UPDATE players SET free_pulls_today=free_pulls_today+1, total_pulls=total_pulls+1 WHERE user_id=?",
-            (user_id,))
-        await db.commit()
+    async with _writer() as db:
+        cur = await db.execute("""UPDATE players SET free_pulls_today=free_pulls_today+1, total_pulls=total_pulls+1
+            WHERE user_id=? RETURNING *""", (user_id,))
+        row = await cur.fetchone()
+    _cache_player(row)
 
 
 async def use_premium_pull(user_id: int, count: int):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute("UPDATE players SET total_pulls=total_pulls+? WHERE user_id=?", (count, user_id))
-        await db.commit()
+    async with _writer() as db:
+        cur = await db.execute("UPDATE players SET total_pulls=total_pulls+? WHERE user_id=? RETURNING *",
+            (count, user_id))
+        row = await cur.fetchone()
+    _cache_player(row)
 
 
 # ======== КОЛЛЕКЦИЯ ========
-async def add_to_collection(user_id: int, item: dict):
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute("""INSERT OR IGNORE INTO collection 
-            (user_id, unique_id, name, description, rarity, theme, theme_name, 
-             power, luck, magic, special_effects) 
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-            (user_id, item["unique_id"], item["name"], item.get("description", ""),
-             item["rarity"], item["theme"], item["theme_name"],
-             item["power"], item["luck"], item["magic"],
-             json.dumps(item.get("special_effects", []), ensure_ascii=False)))
-        await db.commit()
+async def _insert_items(db, user_id: int, items: list):
+    """
+    Вставляет предметы одним executemany внутри текущей транзакции.
+    Возвращает обновлённую строку игрока (для кэша).
+    """
+    await db.executemany("""INSERT INTO collection 
+        (user_id, unique_id, seed, rarity, theme) 
+        VALUES (?, ?, ?, ?, ?)""",
+        [item.to_row(user_id) for item in items])
+    await _apply_collection_stats(db, user_id, calc_collection_stats(items))
+    
+    # Размер коллекции для лидерборда — из только что обновлённых агрегатов
+    cur = await db.execute("""UPDATE players SET collection_size=COALESCE(
+        (SELECT total FROM collection_stats WHERE collection_stats.user_id=players.user_id), 0)
+        WHERE user_id=? RETURNING *""", (user_id,))
+    return await cur.fetchone()
+
+
+async def _apply_collection_stats(db, user_id: int, delta: dict):
+    """Прибавляет к агрегатам игрока статистику новых предметов"""
+    rarity_values = [delta["by_rarity"].get(r, 0) for r in RARITIES]
+    await db.execute(f"""INSERT INTO collection_stats
+        (user_id, total, total_power, total_luck, total_magic, {", ".join(RARITIES)})
+        VALUES ({", ".join("?" * (5 + len(RARITIES)))})
+        ON CONFLICT(user_id) DO UPDATE SET
+        total=total+excluded.total,
+        total_power=total_power+excluded.total_power,
+        total_luck=total_luck+excluded.total_luck,
+        total_magic=total_magic+excluded.total_magic,
+        {", ".join(f"{r}={r}+excluded.{r}" for r in RARITIES)}""",
+        (user_id, delta["total"], delta["total_power"], delta["total_luck"], delta["total_magic"],
+         *rarity_values))
+    await db.executemany("""INSERT INTO collection_theme_stats (user_id, theme, count)
+        VALUES (?, ?, ?)
+        ON CONFLICT(user_id, theme) DO UPDATE SET count=count+excluded.count""",
+        [(user_id, theme, count) for theme, count in delta["by_theme"].items()])
+
+
+async def _rebuild_collection_stats(db, user_id: int = None):
+    """
+    Пересчитывает агрегаты из таблицы collection (для игрока или для всех).
+    Работает со схемой до миграции 005, где статы лежали в колонках.
+    """
+    where, params = ("WHERE user_id=?", (user_id,)) if user_id is not None else ("", ())
+    await db.execute(f"DELETE FROM collection_stats {where}", params)
+    await db.execute(f"DELETE FROM collection_theme_stats {where}", params)
+    await db.execute(f"""INSERT INTO collection_stats
+        (user_id, total, total_power, total_luck, total_magic, {", ".join(RARITIES)})
+        SELECT user_id, COUNT(*), SUM(power), SUM(luck), SUM(magic),
+        {", ".join(f"SUM(rarity='{r}')" for r in RARITIES)}
+        FROM collection {where} GROUP BY user_id""", params)
+    await db.execute(f"""INSERT INTO collection_theme_stats (user_id, theme, count)
+        SELECT user_id, theme, COUNT(*) FROM collection {where}
+        GROUP BY user_id, theme""", params)
+
+
+async def add_to_collection(user_id: int, item: Item):
+    async with _writer() as db:
+        row = await _insert_items(db, user_id, [item])
+    _cache_player(row)
+
+
+# Старые предметы (без seed) берут текстовые поля из collection_legacy
+_ITEM_SELECT = """SELECT c.*, l.name, l.description, l.theme_name,
+    l.power, l.luck, l.magic, l.special_effects
+    FROM collection c LEFT JOIN collection_legacy l ON l.id=c.id"""
 
 
 async def get_collection(user_id: int, limit: int = None, offset: int = 0) -> list:
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        query = "SELECT * FROM collection WHERE user_id=? ORDER BY obtained_at DESC"
+    async with _reader() as db:
+        query = f"{_ITEM_SELECT} WHERE c.user_id=? ORDER BY c.obtained_at DESC, c.id DESC"
         params = [user_id]
         if limit:
             query += " LIMIT ? OFFSET ?"
             params.extend([limit, offset])
         cur = await db.execute(query, params)
-        rows = await cur.fetchall()
-        items = []
-        for row in rows:
-            item = dict(row)
-            if item.get("special_effects"):
-                try:
-                    item["special_effects"] = json.loads(item["special_effects"])
-                except:
-                    item["special_effects"] = []
-            items.append(item)
-        return items
+        return [Item.from_row(row) for row in await cur.fetchall()]
+
+
+async def get_collection_page(user_id: int, limit: int, after: tuple = None, before: tuple = None) -> list:
+    """
+    Страница коллекции по курсору (obtained_at, id), от новых к старым.
+    after — предметы старше курсора (вперёд), before — новее (назад).
+    Читает только limit строк, как бы глубоко ни была страница.
+    """
+    async with _reader() as db:
+        if before:
+            cur = await db.execute(f"""{_ITEM_SELECT}
+                WHERE c.user_id=? AND (c.obtained_at, c.id) > (?, ?)
+                ORDER BY c.obtained_at, c.id LIMIT ?""", (user_id, *before, limit))
+            rows = list(reversed(await cur.fetchall()))
+        else:
+            query = f"{_ITEM_SELECT} WHERE c.user_id=?"
+            params = [user_id]
+            if after:
+                query += " AND (c.obtained_at, c.id) < (?, ?)"
+                params.extend(after)
+            query += " ORDER BY c.obtained_at DESC, c.id DESC LIMIT ?"
+            params.append(limit)
+            cur = await db.execute(query, params)
+            rows = await cur.fetchall()
+        return [Item.from_row(row) for row in rows]
 
 
 async def get_collection_count(user_id: int) -> int:
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        cur = await db.execute("SELECT COUNT(*) FROM collection WHERE user_id=?", (user_id,))
-        return (await cur.fetchone())[0]
+    async with _reader() as db:
+        cur = await db.execute("SELECT total FROM collection_stats WHERE user_id=?", (user_id,))
+        row = await cur.fetchone()
+        return row[0] if row else 0
 
 
-async def has_item(user_id: int, unique_id: str) -> bool:
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+async def get_collection_stats(user_id: int) -> dict:
+    """Статистика коллекции из агрегатов — без чтения самих предметов"""
+    async with _reader() as db:
+        cur = await db.execute("SELECT * FROM collection_stats WHERE user_id=?", (user_id,))
+        row = await cur.fetchone()
+        cur = await db.execute("SELECT theme, count FROM collection_theme_stats WHERE user_id=?", (user_id,))
+        themes = await cur.fetchall()
+    
+    if not row:
+        return calc_collection_stats([])
+    return {
+        "total": row["total"],
+        "by_rarity": {r: row[r] for r in RARITIES if row[r]},
+        "by_theme": {t["theme"]: t["count"] for t in themes if t["count"]},
+        "total_power": row["total_power"],
+        "total_luck": row["total_luck"],
+        "total_magic": row["total_magic"],
+    }
+
+
+async def get_item(user_id: int, item_id: int) -> Item | None:
+    """Один предмет по первичному ключу; недавно открытые — из кэша"""
+    key = (user_id, item_id)
+    item = _item_cache.get(key)
+    if item is not None:
+        return item
+    async with _reader() as db:
+        cur = await db.execute(f"{_ITEM_SELECT} WHERE c.id=? AND c.user_id=?", (item_id, user_id))
+        row = await cur.fetchone()
+    if not row:
+        return None
+    item = Item.from_row(row)
+    _item_cache.put(key, item)
+    return item
+
+
+async def has_item(user_id: int, unique_id: int) -> bool:
+    async with _reader() as db:
         cur = await db.execute("SELECT 1 FROM collection WHERE user_id=? AND unique_id=?", (user_id, unique_id))
         return await cur.fetchone() is not None
 
 
 async def get_collection_by_rarity(user_id: int, rarity: str) -> list:
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        cur = await db.execute("SELECT * FROM collection WHERE user_id=? AND rarity=? ORDER BY obtained_at DESC",
+    async with _reader() as db:
+        cur = await db.execute(f"{_ITEM_SELECT} WHERE c.user_id=? AND c.rarity=? ORDER BY c.obtained_at DESC",
             (user_id, rarity))
-        rows = await cur.fetchall()
-        items = []
-        for row in rows:
-            item = dict(row)
-            if item.get("special_effects"):
-                try:
-                    item["special_effects"] = json.loads(item["special_effects"])
-                except:
-                    item["special_effects"] = []
-            items.append(item)
-        return items
+        return [Item.from_row(row) for row in await cur.fetchall()]
 
 
 async def get_collection_by_theme(user_id: int, theme: str) -> list:
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        cur = await db.execute("SELECT * FROM collection WHERE user_id=? AND theme=? ORDER BY obtained_at DESC",
+    async with _reader() as db:
+        cur = await db.execute(f"{_ITEM_SELECT} WHERE c.user_id=? AND c.theme=? ORDER BY c.obtained_at DESC",
             (user_id, theme))
-        rows = await cur.fetchall()
-        items = []
-        for row in rows:
-            item = dict(row)
-            if item.get("special_effects"):
-                try:
-                    item["special_effects"] = json.loads(item["special_effects"])
-                except:
-                    item["special_effects"] = []
-            items.append(item)
-        return items
+        return [Item.from_row(row) for row in await cur.fetchall()]
 
 
 # ======== КВЕСТЫ ========
+async def _load_quest_book(db, user_id: int, today: str) -> QuestBook:
+    """Квесты игрока на сегодня: из кэша или одним SELECT"""
+    book = _quest_cache.get((user_id, today))
+    if book is None:
+        cur = await db.execute("SELECT * FROM quests WHERE user_id=? AND date=? ORDER BY id", (user_id, today))
+        book = QuestBook(today, [dict(r) for r in await cur.fetchall()])
+    return book
+
+
+def _store_quest_book(user_id: int, book: QuestBook, changes: list = ()):
+    """Вызывается после коммита: применяет изменения к книге в кэше"""
+    QuestBook.apply(changes)
+    _quest_cache.put((user_id, book.date), book)
+
+
 async def get_daily_quests(user_id: int) -> list:
     today = datetime.now().strftime("%Y-%m-%d")
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        cur = await db.execute("SELECT * FROM quests WHERE user_id=? AND date=?", (user_id, today))
-        rows = await cur.fetchall()
-        return [dict(r) for r in rows]
+    async with _reader() as db:
+        book = await _load_quest_book(db, user_id, today)
+    # Пока мы читали, писатель мог положить более свежую книгу — она главнее
+    book = _quest_cache.get((user_id, today)) or book
+    _store_quest_book(user_id, book)
+    return [dict(q) for q in book.quests]
 
 
 async def create_daily_quests(user_id: int, quests: list):
     today = datetime.now().strftime("%Y-%m-%d")
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        for q in quests:
-            await db.execute("""INSERT INTO quests 
-                (user_id, quest_type, description, target, reward_gold, reward_stars, date)
-                VALUES (?, ?, ?, ?, ?, ?, ?)""",
-                (user_id, q["type"], q["description"], q["target"], q["reward_gold"], q["reward_stars"], today))
-        await db.commit()
+    async with _writer() as db:
+        await db.executemany("""INSERT INTO quests 
+            (user_id, quest_type, description, target, reward_gold, reward_stars, date)
+            VALUES (?, ?, ?, ?, ?, ?, ?)""",
+            [(user_id, q["type"], q["description"], q["target"], q["reward_gold"], q["reward_stars"], today)
+             for q in quests])
+        _quest_cache.pop((user_id, today))
+        # Квесты на размер коллекции и темы могут быть выполнены сразу
+        book, changes = await _advance_quests(db, user_id, {}, today)
+    _store_quest_book(user_id, book, changes)
+
+
+async def _advance_quests(db, user_id: int, events: dict, today: str, collection_size: int = None):
+    """
+    Оценивает события {quest_type: amount} по квестам игрока в памяти.
+    Размер коллекции и покрытие тем считаются, только если есть такие
+    активные квесты. В БД пишутся лишь квесты с изменившимся прогрессом.
+    Возвращает (книга, изменения) — передайте их в _store_quest_book после коммита.
+    """
+    book = await _load_quest_book(db, user_id, today)
+    events = {quest_type: amount for quest_type, amount in events.items() if amount and book.wants(quest_type)}
+    
+    if book.wants("collection_size"):
+        if collection_size is None:
+            cur = await db.execute("SELECT collection_size FROM players WHERE user_id=?", (user_id,))
+            row = await cur.fetchone()
+            collection_size = row[0] if row else 0
+        events["collection_size"] = collection_size
+    if book.wants("theme_complete"):
+        cur = await db.execute("SELECT COUNT(*) FROM collection_theme_stats WHERE user_id=? AND count>0",
+            (user_id,))
+        events["theme_complete"] = int((await cur.fetchone())[0] >= len(THEMES))
+    
+    changes = book.evaluate(events)
+    if changes:
+        await db.executemany("UPDATE quests SET progress=?, is_completed=? WHERE id=?",
+            [(progress, completed, q["id"]) for q, progress, completed in changes])
+    return book, changes
 
 
-async def update_quest_progress(user_id: int, quest_type: str, amount: int = 1):
+async def apply_quest_events(user_id: int, events: dict):
+    """Применяет прогресс квестов {quest_type: amount}; без подходящих квестов — без записи"""
     today = datetime.now().strftime("%Y-%m-%d")
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute("""UPDATE quests SET progress=MIN(progress+?, target),
-            is_completed=CASE WHEN progress+?>=target THEN 1 ELSE 0 END
-            WHERE user_id=? AND quest_type=? AND date=? AND is_claimed=0""",
-            (amount, amount, user_id, quest_type, today))
-        await db.commit()
+    async with _writer() as db:
+        book, changes = await _advance_quests(db, user_id, events, today)
+    _store_quest_book(user_id, book, changes)
+
+
+async def update_quest_progress(user_id: int, quest_type: str, amount: int = 1):
+    await apply_quest_events(user_id, {quest_type: amount})
 
 
 async def claim_quest(user_id: int, quest_id: int) -> dict | None:
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
+    async with _writer() as db:
         cur = await db.execute("SELECT * FROM quests WHERE id=? AND user_id=? AND is_completed=1 AND is_claimed=0",
             (quest_id, user_id))
         q = await cur.fetchone()
@@ -276,10 +821,82 @@ async def claim_quest(user_id: int, quest_id: int) -> dict | None:
             return None
         q = dict(q)
         await db.execute("UPDATE quests SET is_claimed=1 WHERE id=?", (quest_id,))
-        await db.execute("UPDATE players SET gold=gold+?, stars=stars+? WHERE user_id=?",
+        cur = await db.execute("UPDATE players SET gold=gold+?, stars=stars+? WHERE user_id=? RETURNING *",
             (q["reward_gold"], q["reward_stars"], user_id))
-        await db.commit()
-        return q
+        row = await cur.fetchone()
+    _cache_player(row)
+    book = _quest_cache.get((user_id, q["date"]))
+    if book is not None:
+        book.claim(quest_id)
+    return q
+
+
+# ======== ТЯГИ ========
+async def commit_pull(user_id: int, pack_id: str, items: list = None, stream_seed: int = None) -> list | None:
+    """
+    Проводит тягу одной транзакцией: списывает валюту (или бесплатный тяг),
+    выдаёт номер тяги, добавляет предметы, увеличивает total_pulls,
+    двигает квесты и пишет тягу в журнал pulls.
+    Без items предметы генерируются из потока pull_stream_seed(user_id, pull_no),
+    поэтому тягу можно воспроизвести через replay_pull. Готовые items (из
+    резерва) передаются вместе с stream_seed потока, из которого получены.
+    Возвращает выданные предметы или None, если не хватило ресурсов —
+    тогда ничего не записано.
+    """
+    from config import DAILY_FREE_PULLS
+    pack = GACHA_PACKS[pack_id]
+    count = len(items) if items is not None else pack_item_count(pack_id)
+    today = datetime.now().strftime("%Y-%m-%d")
+    
+    async with _writer() as db:
+        if pack.get("daily_limit"):
+            # Бесплатный тяг: счётчик сбрасывается, если наступил новый день
+            cur = await db.execute("""UPDATE players SET
+                free_pulls_today=CASE WHEN free_pulls_reset_date=? THEN free_pulls_today+1 ELSE 1 END,
+                free_pulls_reset_date=?, total_pulls=total_pulls+?
+                WHERE user_id=? AND (free_pulls_reset_date<>? OR free_pulls_today<?)""",
+                (today, today, count, user_id, today, DAILY_FREE_PULLS))
+            if cur.rowcount == 0:
+                return None
+        elif not await _debit(db, user_id, gold=pack["cost_gold"], stars=pack["cost_stars"], pulls=count):
+            return None
+        
+        # Номер тяги выдаётся под блокировкой писателя — гонок нет
+        cur = await db.execute("UPDATE players SET pull_counter=pull_counter+1 WHERE user_id=? RETURNING pull_counter",
+            (user_id,))
+        pull_no = (await cur.fetchone())[0]
+        if items is None:
+            stream_seed = pull_stream_seed(user_id, pull_no)
+            items = gacha_pull(pack_id, rng=pull_stream(stream_seed))
+        await db.execute("""INSERT INTO pulls (user_id, pull_no, pack_id, stream_seed, item_count)
+            VALUES (?, ?, ?, ?, ?)""", (user_id, pull_no, pack_id, stream_seed, len(items)))
+        
+        row = await _insert_items(db, user_id, items)
+        book, changes = await _advance_quests(db, user_id, get_quest_events(items), today,
+            collection_size=row["collection_size"])
+    
+    _cache_player(row)
+    _store_quest_book(user_id, book, changes)
+    return items
+
+
+async def get_pull(user_id: int, pull_no: int) -> dict | None:
+    """Запись журнала тяг"""
+    async with _reader() as db:
+        cur = await db.execute("SELECT * FROM pulls WHERE user_id=? AND pull_no=?", (user_id, pull_no))
+        row = await cur.fetchone()
+        return dict(row) if row else None
+
+
+async def replay_pull(user_id: int, pull_no: int) -> list | None:
+    """
+    Воспроизводит тягу для аудита: те же редкости, темы и seed'ы предметов
+    (unique_id будут новыми). Верно, пока не менялись веса пака.
+    """
+    pull = await get_pull(user_id, pull_no)
+    if not pull or pull["stream_seed"] is None:
+        return None
+    return gacha_pull(pull["pack_id"], rng=pull_stream(pull["stream_seed"]))
 
 
 # ======== ЕЖЕДНЕВНЫЙ БОНУС ========
@@ -295,54 +912,58 @@ async def check_daily(user_id: int) -> dict | None:
     yesterday = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
     new_streak = player["daily_streak"] + 1 if player["last_daily"] == yesterday else 1
     
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute("UPDATE players SET last_daily=?, daily_streak=? WHERE user_id=?",
+    async with _writer() as db:
+        cur = await db.execute("UPDATE players SET last_daily=?, daily_streak=? WHERE user_id=? RETURNING *",
             (today, new_streak, user_id))
-        await db.commit()
+        row = await cur.fetchone()
+    _cache_player(row)
     
     return {"daily_streak": new_streak}
 
 
 # ======== РЕФЕРАЛЫ ========
 async def get_referrals_count(user_id: int) -> int:
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with _reader() as db:
         cur = await db.execute("SELECT COUNT(*) FROM players WHERE referrer_id=?", (user_id,))
         return (await cur.fetchone())[0]
 
 
 # ======== ЛИДЕРБОРД ========
 async def get_leaderboard(limit: int = 10) -> list:
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        cur = await db.execute("""SELECT user_id, username, first_name, 
-            (SELECT COUNT(*) FROM collection WHERE collection.user_id=players.user_id) as collection_size,
-            total_pulls
+    """Топ по размеру коллекции — обход индекса, ответ кэшируется на пару секунд"""
+    leaders = _leaderboard_cache.get(limit)
+    if leaders is not None:
+        return leaders
+    async with _reader() as db:
+        cur = await db.execute("""SELECT user_id, username, first_name, collection_size, total_pulls
             FROM players 
             ORDER BY collection_size DESC, total_pulls DESC
             LIMIT ?""", (limit,))
         rows = await cur.fetchall()
-        return [
-            {
-                "user_id": r[0],
-                "username": r[1],
-                "first_name": r[2],
-                "collection_size": r[3],
-                "total_pulls": r[4],
-            }
-            for r in rows
-        ]
+    leaders = [
+        {
+            "user_id": r[0],
+            "username": r[1],
+            "first_name": r[2],
+            "collection_size": r[3],
+            "total_pulls": r[4],
+        }
+        for r in rows
+    ]
+    _leaderboard_cache.put(limit, leaders)
+    return leaders
 
 
 async def get_player_rank(user_id: int) -> int:
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with _reader() as db:
         cur = await db.execute("""SELECT COUNT(*)+1 FROM players
-            WHERE (SELECT COUNT(*) FROM collection WHERE collection.user_id=players.user_id) >
-            (SELECT COUNT(*) FROM collection WHERE collection.user_id=?)""", (user_id,))
+            WHERE collection_size > (SELECT collection_size FROM players WHERE user_id=?)""", (user_id,))
         return (await cur.fetchone())[0]
 
 
 # ======== СТАТИСТИКА ========
 async def get_bot_stats() -> dict:
-    async with aiosqlite.connect(DATABASE_PATH) as db:
+    async with _reader() as db:
         total_players = (await (await db.execute("SELECT COUNT(*) FROM players")).fetchone())[0]
         total_items = (await (await db.execute("SELECT COUNT(*) FROM collection")).fetchone())[0]
         total_pulls = (await (await db.execute("SELECT SUM(total_pulls) FROM players")).fetchone())[0] or 0
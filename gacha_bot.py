@@ -6,6 +6,7 @@ import asyncio
 import logging
 from datetime import datetime
 
+from aiohttp import web
 from aiogram import Bot, Dispatcher, types, F
 from aiogram.filters import Command, CommandStart
 from aiogram.types import (
@@ -16,21 +17,79 @@ from aiogram.types import (
 )
 from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 
 import config
 import database as db
 from gacha_data import (
     RARITY_EMOJI, RARITY_NAMES, THEMES,
-    GACHA_PACKS, gacha_pull, generate_daily_quests,
-    format_item_short, format_item_full, get_collection_stats,
-    REFERRAL_BONUS,
+    GACHA_PACKS, generate_daily_quests,
+    format_item_short, format_item_full,
+    REFERRAL_BONUS, set_id_worker, get_item_text_cache_stats,
 )
+import metrics
+from middlewares import (
+    ConcurrencyLimitMiddleware, HandlerMetricsMiddleware,
+    UpdateMetricsMiddleware, UserSerializationMiddleware,
+)
+from outbound import LANE_NAMES, SendQueue
+from reservoir import ItemReservoir
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 bot = Bot(token=config.BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+send_queue = SendQueue(
+    global_rate=config.SEND_GLOBAL_RATE, chat_rate=config.SEND_CHAT_RATE, chat_burst=config.SEND_CHAT_BURST,
+    group_rate=config.SEND_GROUP_RATE, workers=config.SEND_WORKERS, max_retries=config.SEND_MAX_RETRIES,
+)
+bot.session.middleware(send_queue)
 dp = Dispatcher()
+# Метрики: полное время апдейта (с ожиданием своей очереди) и время обработчиков
+dp.update.outer_middleware(UpdateMetricsMiddleware())
+for observer in (dp.message, dp.callback_query, dp.pre_checkout_query):
+    observer.middleware(HandlerMetricsMiddleware())
+# Апдейты игрока — по одному, двойные нажатия схлопываются
+user_serializer = UserSerializationMiddleware(config.USER_MAX_PENDING)
+dp.update.outer_middleware(user_serializer)
+# Общий лимит одновременных апдейтов — после очереди игрока, в обоих режимах:
+# ждущие апдейты одного игрока не занимают слоты остальных
+update_limiter = ConcurrencyLimitMiddleware(config.UPDATES_CONCURRENCY)
+dp.update.outer_middleware(update_limiter)
+reservoir = ItemReservoir(config.RESERVOIR_SIZES, config.RESERVOIR_REFILL_BATCH, config.RESERVOIR_REFILL_INTERVAL)
+
+
+# ======== МЕТРИКИ ========
+def _cache_metrics() -> dict:
+    caches = {
+        "player": db.get_player_cache_stats(),
+        "item_text_short": get_item_text_cache_stats()["short"],
+        "item_text_full": get_item_text_cache_stats()["full"],
+        "reservoir": reservoir.stats(),
+    }
+    values = {}
+    for name, stats in caches.items():
+        values[(name, "hit")] = stats["hits"]
+        values[(name, "miss")] = stats["misses"]
+    return values
+
+
+def _send_metrics() -> dict:
+    sends = send_queue.stats()
+    return {("sent",): sends["sent"], ("retried",): sends["retries"], ("failed",): sends["failed"]}
+
+
+metrics.Counter("gacha_cache_requests_total", "Обращения к кэшам", ("cache", "result"), fn=_cache_metrics)
+metrics.Gauge("gacha_reservoir_pulls", "Готовых тяг в резерве", ("pack",),
+              fn=lambda: {(pack,): size for pack, size in reservoir.stats()["sizes"].items()})
+metrics.Gauge("gacha_send_queue_depth", "Запросов в исходящей очереди",
+              fn=lambda: {(): send_queue.stats()["depth"]})
+metrics.Counter("gacha_send_queued_total", "Поставлено в исходящую очередь", ("lane",),
+                fn=lambda: {(lane,): n for lane, n in zip(LANE_NAMES, send_queue.queued)})
+metrics.Counter("gacha_send_requests_total", "Исходящие запросы по итогу", ("result",), fn=_send_metrics)
+metrics.Counter("gacha_updates_skipped_total", "Апдейты, не дошедшие до обработчика", ("reason",),
+                fn=lambda: {("coalesced",): user_serializer.coalesced, ("dropped",): user_serializer.dropped})
 
 
 # ======== КЛАВИАТУРЫ ========
@@ -50,6 +109,16 @@ def kb_back():
     return IKM(inline_keyboard=[[IKB(text="🏠 Меню", callback_data="menu")]])
 
 
+async def edit_or_answer(message: types.Message, text: str, reply_markup=None):
+    """Редактирует сообщение бота; если это невозможно — присылает новое"""
+    try:
+        await message.edit_text(text, reply_markup=reply_markup)
+    except TelegramBadRequest as e:
+        if "message is not modified" in e.message:
+            return
+        await message.answer(text, reply_markup=reply_markup)
+
+
 # ======== /START ========
 @dp.message(CommandStart())
 async def cmd_start(message: types.Message):
@@ -63,24 +132,22 @@ async def cmd_start(message: types.Message):
     if len(args) > 1 and args[1].startswith("ref"):
         try:
             referrer_id = int(args[1][3:])
-            if referrer_id != user_id:
-                # Начисляем бонусы
-                await db.add_stars(referrer_id, config.REFERRAL_BONUS_REFERRER_STARS)
-                await db.add_gold(referrer_id, config.REFERRAL_BONUS_REFERRER_GOLD)
-                await db.add_stars(user_id, config.REFERRAL_BONUS_REFEREE_STARS)
-                await db.add_gold(user_id, config.REFERRAL_BONUS_REFEREE_GOLD)
-                
-                try:
-                    await bot.send_message(
-                        referrer_id,
-                        f"🎉 По твоей ссылке пришёл новый игрок!\n"
-                        f"💎 +{config.REFERRAL_BONUS_REFERRER_STARS} Stars\n"
-                        f"💰 +{config.REFERRAL_BONUS_REFERRER_GOLD} золота"
-                    )
-                except:
-                    pass
-        except:
-            pass
+        except ValueError:
+            referrer_id = None
+        if referrer_id is not None and referrer_id != user_id:
+            # Начисляем бонусы
+            await db.add_stars(referrer_id, config.REFERRAL_BONUS_REFERRER_STARS)
+            await db.add_gold(referrer_id, config.REFERRAL_BONUS_REFERRER_GOLD)
+            await db.add_stars(user_id, config.REFERRAL_BONUS_REFEREE_STARS)
+            await db.add_gold(user_id, config.REFERRAL_BONUS_REFEREE_GOLD)
+            
+            # Уведомление уходит фоном с низким приоритетом
+            send_queue.notify(
+                bot, referrer_id,
+                f"🎉 По твоей ссылке пришёл новый игрок!\n"
+                f"💎 +{config.REFERRAL_BONUS_REFERRER_STARS} Stars\n"
+                f"💰 +{config.REFERRAL_BONUS_REFERRER_GOLD} золота"
+            )
     
     # Создаём игрока
     await db.create_player(user_id, username, first_name, referrer_id)
@@ -143,10 +210,7 @@ async def cb_menu(callback: types.CallbackQuery):
         f"Выбери действие:"
     )
     
-    try:
-        await callback.message.edit_text(text, reply_markup=kb_main())
-    except:
-        await callback.message.answer(text, reply_markup=kb_main())
+    await edit_or_answer(callback.message, text, reply_markup=kb_main())
 
 
 # ======== ГАЧА ========
@@ -191,10 +255,7 @@ async def cb_pull(callback: types.CallbackQuery):
         f"<i>Каждый предмет уникален!</i>"
     )
     
-    try:
-        await callback.message.edit_text(text, reply_markup=IKM(inline_keyboard=buttons))
-    except:
-        await callback.message.answer(text, reply_markup=IKM(inline_keyboard=buttons))
+    await edit_or_answer(callback.message, text, reply_markup=IKM(inline_keyboard=buttons))
 
 
 @dp.callback_query(F.data == "pull_free")
@@ -206,30 +267,19 @@ async def cb_pull_free(callback: types.CallbackQuery):
         await callback.answer("Бесплатные тяги закончились! Завтра будет больше.", show_alert=True)
         return
     
-    await callback.answer()
-    await db.use_free_pull(user_id)
-    
-    # Тяга
-    items = gacha_pull("single_free")
-    item = items[0]
-    
-    # Добавляем в коллекцию
-    await db.add_to_collection(user_id, item)
-    
-    # Обновляем квесты
-    await db.update_quest_progress(user_id, "daily_pull")
+    # Предметы берутся из резерва; списание, коллекция и квесты — одной транзакцией
+    prepared = reservoir.take("single_free")
+    items = await db.commit_pull(user_id, "single_free", prepared.items, prepared.stream_seed)
+    if not items:
+        reservoir.give_back("single_free", prepared)
+        await callback.answer("Бесплатные тяги закончились! Завтра будет больше.", show_alert=True)
+        return
     
-    # Проверяем редкость для квестов
-    if item["rarity"] == "rare":
-        await db.update_quest_progress(user_id, "collect_rare")
-    elif item["rarity"] == "epic":
-        await db.update_quest_progress(user_id, "collect_epic")
-    elif item["rarity"] in ("legendary", "mythic"):
-        await db.update_quest_progress(user_id, "collect_legendary")
+    await callback.answer()
     
     text = (
         f"🎰 <b>Бесплатный тяг!</b>\n\n"
-        f"{format_item_full(item)}\n\n"
+        f"{prepared.text}\n\n"
         f"✅ Добавлено в коллекцию!\n"
         f"🎰 Осталось: {free_left - 1}/{config.DAILY_FREE_PULLS}"
     )
@@ -240,10 +290,7 @@ async def cb_pull_free(callback: types.CallbackQuery):
         [IKB(text="🏠 Меню", callback_data="menu")],
     ])
     
-    try:
-        await callback.message.edit_text(text, reply_markup=keyboard)
-    except:
-        await callback.message.answer(text, reply_markup=keyboard)
+    await edit_or_answer(callback.message, text, reply_markup=keyboard)
 
 
 @dp.callback_query(F.data.startswith("pull_"))
@@ -257,53 +304,24 @@ async def cb_pull_pack(callback: types.CallbackQuery):
     pack = GACHA_PACKS[pack_id]
     user_id = callback.from_user.id
     
-    # Проверка оплаты
-    if pack["cost_stars"] > 0:
-        if not await db.spend_stars(user_id, pack["cost_stars"]):
+    # Предметы берутся из резерва; оплата, коллекция и квесты — одной транзакцией
+    prepared = reservoir.take(pack_id)
+    items = await db.commit_pull(user_id, pack_id, prepared.items, prepared.stream_seed)
+    if not items:
+        reservoir.give_back(pack_id, prepared)
+        if pack["cost_stars"] > 0:
             await callback.answer(f"Не хватает Stars! Нужно {pack['cost_stars']}⭐", show_alert=True)
-            return
-    elif pack["cost_gold"] > 0:
-        if not await db.spend_gold(user_id, pack["cost_gold"]):
+        else:
             await callback.answer(f"Не хватает золота! Нужно {pack['cost_gold']}💰", show_alert=True)
-            return
+        return
     
     await callback.answer()
     
-    # Тяги
-    items = gacha_pull(pack_id)
-    await db.use_premium_pull(user_id, len(items))
-    
-    # Добавляем в коллекцию
-    for item in items:
-        await db.add_to_collection(user_id, item)
-    
-    # Обновляем квесты
-    await db.update_quest_progress(user_id, "daily_pull", len(items))
-    
-    # Проверяем редкости
-    for item in items:
-        if item["rarity"] == "rare":
-            await db.update_quest_progress(user_id, "collect_rare")
-        elif item["rarity"] == "epic":
-            await db.update_quest_progress(user_id, "collect_epic")
-        elif item["rarity"] in ("legendary", "mythic"):
-            await db.update_quest_progress(user_id, "collect_legendary")
-    
     # Форматируем результат
     if len(items) == 1:
-        text = f"🎰 <b>{pack['name']}</b>\n\n{format_item_full(items[0])}\n\n✅ Добавлено в коллекцию!"
+        text = f"🎰 <b>{pack['name']}</b>\n\n{prepared.text}\n\n✅ Добавлено в коллекцию!"
     else:
-        lines = [f"🎰 <b>{pack['name']}</b>\n\n<b>Получено {len(items)} предметов:</b>\n"]
-        for item in items:
-            lines.append(f"{format_item_short(item)}")
-        text = "\n".join(lines) + "\n\n✅ Все добавлены в коллекцию!"
-    
-    # Обновляем размер коллекции для квеста
-    collection_count = await db.get_collection_count(user_id)
-    if collection_count >= 10:
-        await db.update_quest_progress(user_id, "collection_size", 0)  # Проверка
-    if collection_count >= 50:
-        await db.update_quest_progress(user_id, "collection_size", 0)
+        text = f"🎰 <b>{pack['name']}</b>\n\n{prepared.text}\n\n✅ Все добавлены в коллекцию!"
     
     keyboard = IKM(inline_keyboard=[
         [IKB(text="🎰 Ещё тяг", callback_data="pull")],
@@ -311,10 +329,7 @@ async def cb_pull_pack(callback: types.CallbackQuery):
         [IKB(text="🏠 Меню", callback_data="menu")],
     ])
     
-    try:
-        await callback.message.edit_text(text, reply_markup=keyboard)
-    except:
-        await callback.message.answer(text, reply_markup=keyboard)
+    await edit_or_answer(callback.message, text, reply_markup=keyboard)
 
 
 # ======== КОЛЛЕКЦИЯ ========
@@ -327,36 +342,45 @@ async def cb_collection(callback: types.CallbackQuery):
 @dp.callback_query(F.data.startswith("colp_"))
 async def cb_collection_page(callback: types.CallbackQuery):
     await callback.answer()
-    page = int(callback.data.replace("colp_", ""))
-    await show_collection(callback.from_user.id, callback.message, page=page)
+    # colp_{n|p}_{страница}_{id}_{obtained_at} — курсор от соседней страницы
+    parts = callback.data.split("_", 4)
+    if len(parts) != 5 or parts[1] not in ("n", "p"):
+        # Старые кнопки без курсора — открываем первую страницу
+        await show_collection(callback.from_user.id, callback.message)
+        return
+    _, direction, page, item_id, obtained_at = parts
+    cursor = (obtained_at, int(item_id))
+    await show_collection(
+        callback.from_user.id, callback.message, page=int(page),
+        after=cursor if direction == "n" else None,
+        before=cursor if direction == "p" else None,
+    )
 
 
-async def show_collection(user_id: int, message: types.Message, page: int = 1):
-    collection = await db.get_collection(user_id)
+async def show_collection(user_id: int, message: types.Message, page: int = 1,
+                          after: tuple = None, before: tuple = None):
+    # Статистика
+    stats = await db.get_collection_stats(user_id)
     
-    if not collection:
+    if not stats["total"]:
         text = "📦 <b>Коллекция пуста!</b>\n\nСделай свой первый тяг! 🎰"
-        try:
-            await message.edit_text(text, reply_markup=IKM(inline_keyboard=[
-                [IKB(text="🎰 Тянуть гача", callback_data="pull")],
-                [IKB(text="🏠 Меню", callback_data="menu")],
-            ]))
-        except:
-            await message.answer(text, reply_markup=kb_back())
+        await edit_or_answer(message, text, reply_markup=IKM(inline_keyboard=[
+            [IKB(text="🎰 Тянуть гача", callback_data="pull")],
+            [IKB(text="🏠 Меню", callback_data="menu")],
+        ]))
         return
     
-    # Статистика
-    stats = get_collection_stats(collection)
-    
     # Пагинация
     per_page = 5
-    total_pages = max(1, (len(collection) + per_page - 1) // per_page)
+    total_pages = max(1, (stats["total"] + per_page - 1) // per_page)
     page = max(1, min(page, total_pages))
-    start = (page - 1) * per_page
-    page_items = collection[start:start + per_page]
+    page_items = await db.get_collection_page(user_id, per_page, after=after, before=before)
+    if not page_items:
+        page = 1
+        page_items = await db.get_collection_page(user_id, per_page)
     
     lines = [
-        f"📦 <b>Коллекция</b> ({len(collection)} предметов)\n",
+        f"📦 <b>Коллекция</b> ({stats['total']} предметов)\n",
         f"📊 <b>Статистика:</b>",
         f"💪 Сила: {stats['total_power']}",
         f"🍀 Удача: {stats['total_luck']:.1f}",
@@ -380,34 +404,32 @@ async def show_collection(user_id: int, message: types.Message, page: int = 1):
     buttons = []
     for item in page_items:
         buttons.append([IKB(
-            text=f"👆 {item['name']}",
-            callback_data=f"item_{item['id']}"
+            text=f"👆 {item.name}",
+            callback_data=f"item_{item.id}"
         )])
     
     # Навигация
     nav = []
     if page > 1:
-        nav.append(IKB(text="◀️", callback_data=f"colp_{page - 1}"))
+        first = page_items[0]
+        nav.append(IKB(text="◀️", callback_data=f"colp_p_{page - 1}_{first.id}_{first.obtained_at}"))
     if total_pages > 1:
         nav.append(IKB(text=f"{page}/{total_pages}", callback_data="noop"))
     if page < total_pages:
-        nav.append(IKB(text="▶️", callback_data=f"colp_{page + 1}"))
+        last = page_items[-1]
+        nav.append(IKB(text="▶️", callback_data=f"colp_n_{page + 1}_{last.id}_{last.obtained_at}"))
     if nav:
         buttons.append(nav)
     
     buttons.append([IKB(text="🏠 Меню", callback_data="menu")])
     
-    try:
-        await message.edit_text(text, reply_markup=IKM(inline_keyboard=buttons))
-    except:
-        await message.answer(text, reply_markup=IKM(inline_keyboard=buttons))
+    await edit_or_answer(message, text, reply_markup=IKM(inline_keyboard=buttons))
 
 
 @dp.callback_query(F.data.startswith("item_"))
 async def cb_item_detail(callback: types.CallbackQuery):
     item_id = int(callback.data.replace("item_", ""))
-    collection = await db.get_collection(callback.from_user.id)
-    item = next((i for i in collection if i["id"] == item_id), None)
+    item = await db.get_item(callback.from_user.id, item_id)
     
     if not item:
         await callback.answer("Предмет не найден!", show_alert=True)
@@ -422,10 +444,7 @@ async def cb_item_detail(callback: types.CallbackQuery):
         [IKB(text="🏠 Меню", callback_data="menu")],
     ])
     
-    try:
-        await callback.message.edit_text(text, reply_markup=keyboard)
-    except:
-        await callback.message.answer(text, reply_markup=keyboard)
+    await edit_or_answer(callback.message, text, reply_markup=keyboard)
 
 
 # ======== КВЕСТЫ ========
@@ -457,10 +476,7 @@ async def cb_quests(callback: types.CallbackQuery):
     
     buttons.append([IKB(text="🏠 Меню", callback_data="menu")])
     
-    try:
-        await callback.message.edit_text("\n".join(lines), reply_markup=IKM(inline_keyboard=buttons))
-    except:
-        await callback.message.answer("\n".join(lines), reply_markup=IKM(inline_keyboard=buttons))
+    await edit_or_answer(callback.message, "\n".join(lines), reply_markup=IKM(inline_keyboard=buttons))
 
 
 @dp.callback_query(F.data.startswith("qcl_"))
@@ -522,10 +538,7 @@ async def cb_profile(event: types.CallbackQuery | types.Message):
     ])
     
     if edit:
-        try:
-            await msg.edit_text(text, reply_markup=keyboard)
-        except:
-            await msg.answer(text, reply_markup=keyboard)
+        await edit_or_answer(msg, text, reply_markup=keyboard)
     else:
         await msg.answer(text, reply_markup=keyboard)
 
@@ -555,10 +568,7 @@ async def cb_top(callback: types.CallbackQuery):
         [IKB(text="🏠 Меню", callback_data="menu")],
     ])
     
-    try:
-        await callback.message.edit_text(text, reply_markup=keyboard)
-    except:
-        await callback.message.answer(text, reply_markup=keyboard)
+    await edit_or_answer(callback.message, text, reply_markup=keyboard)
 
 
 # ======== РЕФЕРАЛКА ========
@@ -589,10 +599,7 @@ async def cb_referral(callback: types.CallbackQuery):
         [IKB(text="🏠 Меню", callback_data="menu")],
     ])
     
-    try:
-        await callback.message.edit_text(text, reply_markup=keyboard)
-    except:
-        await callback.message.answer(text, reply_markup=keyboard)
+    await edit_or_answer(callback.message, text, reply_markup=keyboard)
 
 
 # ======== МАГАЗИН ========
@@ -620,10 +627,7 @@ async def cb_shop(callback: types.CallbackQuery):
         [IKB(text="🏠 Меню", callback_data="menu")],
     ]
     
-    try:
-        await callback.message.edit_text(text, reply_markup=IKM(inline_keyboard=buttons))
-    except:
-        await callback.message.answer(text, reply_markup=IKM(inline_keyboard=buttons))
+    await edit_or_answer(callback.message, text, reply_markup=IKM(inline_keyboard=buttons))
 
 
 @dp.callback_query(F.data.startswith("buy_s"))
@@ -722,11 +726,25 @@ async def cmd_stats(message: types.Message):
     if message.from_user.id != config.ADMIN_ID:
         return
     stats = await db.get_bot_stats()
+    cache = db.get_player_cache_stats()
+    pulls = reservoir.stats()
+    texts = get_item_text_cache_stats()["full"]
+    sends = send_queue.stats()
+    users = user_serializer.stats()
+    slow = db.slow_log.stats()
     await message.answer(
         f"📊 <b>Статистика</b>\n\n"
         f"👥 Игроков: {stats['total_players']}\n"
         f"📦 Предметов: {stats['total_items']}\n"
-        f"🎰 Тягов: {stats['total_pulls']}"
+        f"🎰 Тягов: {stats['total_pulls']}\n"
+        f"🧠 Кэш игроков: {cache['size']} шт., попаданий {cache['hits']}, промахов {cache['misses']}\n"
+        f"🧺 Резерв тяг: {sum(pulls['sizes'].values())} шт., из резерва {pulls['hits']}, на месте {pulls['misses']}\n"
+        f"📝 Кэш текстов: {texts['size']} шт., попаданий {texts['hits']}, промахов {texts['misses']}\n"
+        f"📤 Отправка: {sends['sent']} шт., в очереди {sends['depth']}, 429 {sends['retries']}, "
+        f"ошибок {sends['failed']}, ожидание ср. {sends['wait_avg_ms']} мс / макс. {sends['wait_max_ms']} мс\n"
+        f"👆 Двойных нажатий схлопнуто: {users['coalesced']}, отброшено апдейтов: {users['dropped']}\n"
+        f"🐢 Медленных запросов: {slow['total']} ({slow['statements']} разных, "
+        f"с полным проходом таблицы {slow['full_scans']})"
     )
 
 
@@ -740,12 +758,69 @@ async def handle_text(message: types.Message):
 
 
 # ======== ЗАПУСК ========
+def build_webhook_app(bot: Bot) -> web.Application:
+    """aiohttp-приложение с обработчиком вебхука на config.WEBHOOK_PATH"""
+    # Без секрета любой может прислать поддельный апдейт, в том числе об оплате
+    if not config.WEBHOOK_SECRET:
+        raise RuntimeError("Для BOT_MODE=webhook задайте WEBHOOK_SECRET")
+    app = web.Application()
+    SimpleRequestHandler(dp, bot, secret_token=config.WEBHOOK_SECRET).register(
+        app, path=config.WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def run_webhook():
+    if not config.WEBHOOK_BASE_URL:
+        raise RuntimeError("Для BOT_MODE=webhook задайте WEBHOOK_BASE_URL")
+    runner = web.AppRunner(build_webhook_app(bot))
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, config.WEBHOOK_HOST, config.WEBHOOK_PORT).start()
+        # Без drop_pending_updates: накопившееся за рестарт Telegram дошлёт сам
+        await bot.set_webhook(
+            f"{config.WEBHOOK_BASE_URL}{config.WEBHOOK_PATH}",
+            secret_token=config.WEBHOOK_SECRET,
+            max_connections=config.WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+        logger.info(f"🌐 Вебхук слушает {config.WEBHOOK_HOST}:{config.WEBHOOK_PORT}{config.WEBHOOK_PATH}")
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+async def run_polling():
+    # Снимаем вебхук, если он был; очередь апдейтов сохраняется
+    await bot.delete_webhook(drop_pending_updates=False)
+    await dp.start_polling(bot)
+
+
 async def main():
+    set_id_worker(config.ITEM_ID_WORKER)
     logger.info("🗄 Инициализация БД...")
     await db.init_db()
-    logger.info("🎰 Запуск бота 'Бесконечная гача'...")
-    await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot)
+    reservoir.start()
+    send_queue.start()
+    db.slow_log.start(config.SLOW_QUERY_SUMMARY_INTERVAL)
+    metrics_runner = None
+    if config.METRICS_PORT:
+        metrics_runner = await metrics.start_metrics_server(config.METRICS_HOST, config.METRICS_PORT)
+        logger.info(f"📊 Метрики: http://{config.METRICS_HOST}:{config.METRICS_PORT}/metrics")
+    logger.info(f"🎰 Запуск бота 'Бесконечная гача' ({config.BOT_MODE})...")
+    try:
+        if config.BOT_MODE == "webhook":
+            await run_webhook()
+        else:
+            await run_polling()
+    finally:
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await send_queue.stop()
+        await reservoir.stop()
+        await db.slow_log.stop()
+        db.slow_log.log_summary()
+        await db.close_db()
 
 
 if __name__ == "__main__":
@@ -2,8 +2,14 @@
 🎰 Бесконечная гача — процедурная генерация предметов
 Каждый предмет уникален! Бесконечная коллекция.
 """
-import random
 import hashlib
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass
+
+from cache import LRUCache
 
 # ============ РЕДКОСТИ ============
 RARITIES = ["common", "uncommon", "rare", "epic", "legendary", "mythic"]
@@ -84,105 +90,294 @@ THEMES = {
     },
 }
 
+THEME_IDS = list(THEMES)
+
+# Множитель статов по редкости
+RARITY_MULTIPLIERS = {
+    "common": 1.0,
+    "uncommon": 1.5,
+    "rare": 2.5,
+    "epic": 4.0,
+    "legendary": 7.0,
+    "mythic": 12.0,
+}
+
+SPECIAL_EFFECTS = ["✨ Светится", "💫 Пульсирует", "🌟 Искрится", "⚡ Энергия", "🔥 Пламя", "❄️ Лёд"]
+
 # ============ ПРОЦЕДУРНАЯ ГЕНЕРАЦИЯ ============
 
-def generate_unique_id(seed: str) -> str:
-    """Генерирует уникальный ID из seed"""
-    return hashlib.md5(seed.encode()).hexdigest()[:12]
+class SnowflakeGenerator:
+    """
+    Монотонные 63-битные ID без хеширования:
+    41 бит — миллисекунды от ID_EPOCH_MS, 10 бит — воркер, 12 бит — счётчик.
+    При исчерпании счётчика или откате часов «занимает» следующую
+    миллисекунду, поэтому ID не повторяются и не убывают.
+    """
+    WORKER_BITS = 10
+    SEQUENCE_BITS = 12
+    MAX_WORKER = (1 << WORKER_BITS) - 1
+    MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+    def __init__(self, worker_id: int = 0, epoch_ms: int = 1704067200000):
+        if not 0 <= worker_id <= self.MAX_WORKER:
+            raise ValueError(f"worker_id должен быть от 0 до {self.MAX_WORKER}")
+        self.worker_id = worker_id
+        self.epoch_ms = epoch_ms
+        self._last_ms = -1
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def next_id(self) -> int:
+        with self._lock:
+            now = time.time_ns() // 1_000_000 - self.epoch_ms
+            if now > self._last_ms:
+                self._last_ms = now
+                self._sequence = 0
+            elif self._sequence < self.MAX_SEQUENCE:
+                self._sequence += 1
+            else:
+                self._last_ms += 1
+                self._sequence = 0
+            return ((self._last_ms << (self.WORKER_BITS + self.SEQUENCE_BITS))
+                    | (self.worker_id << self.SEQUENCE_BITS)
+                    | self._sequence)
+
+    def next_ids(self, count: int) -> list:
+        return [self.next_id() for _ in range(count)]
+
+
+ID_GENERATOR = SnowflakeGenerator()
+
+
+def set_id_worker(worker_id: int):
+    """Номер воркера для ID — у каждого процесса бота должен быть свой"""
+    global ID_GENERATOR
+    ID_GENERATOR = SnowflakeGenerator(worker_id)
+
+
+def generate_unique_id() -> int:
+    """Новый уникальный ID предмета"""
+    return ID_GENERATOR.next_id()
+
+
+class RaritySampler:
+    """
+    Выборка по весам методом псевдонимов (Walker/Vose): таблица строится
+    один раз, каждый бросок — одно random() и одно сравнение, без аллокаций.
+    Веса могут быть дробными; нулевые исходы никогда не выпадают.
+    """
+    __slots__ = ("outcomes", "weights", "_prob", "_alias", "_n")
+
+    def __init__(self, weights: dict):
+        if any(w < 0 for w in weights.values()):
+            raise ValueError("Веса редкостей не могут быть отрицательными")
+        outcomes = [k for k, w in weights.items() if w > 0]
+        if not outcomes:
+            raise ValueError("Нужен хотя бы один положительный вес")
+        total = sum(weights[k] for k in outcomes)
+        n = len(outcomes)
+        scaled = [weights[k] * n / total for k in outcomes]
+        prob = [1.0] * n
+        alias = list(range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            lo, hi = small.pop(), large.pop()
+            prob[lo] = scaled[lo]
+            alias[lo] = hi
+            scaled[hi] -= 1.0 - scaled[lo]
+            (small if scaled[hi] < 1.0 else large).append(hi)
+        
+        self.outcomes = outcomes
+        self.weights = {k: weights[k] / total for k in outcomes}
+        self._prob = prob
+        self._alias = [outcomes[i] for i in alias]
+        self._n = n
+
+    def pick(self, rnd=random.random) -> str:
+        u = rnd() * self._n
+        i = int(u)
+        return self.outcomes[i] if u - i < self._prob[i] else self._alias[i]
+
+    def sample(self, count: int, rnd=random.random) -> list:
+        pick = self.pick
+        return [pick(rnd) for _ in range(count)]
+
 
+RARITY_SAMPLER_FREE = RaritySampler(RARITY_WEIGHTS_FREE)
+RARITY_SAMPLER_PREMIUM = RaritySampler(RARITY_WEIGHTS_PREMIUM)
 
-def pick_rarity(is_premium: bool = False) -> str:
+
+def pick_rarity(is_premium: bool = False, rng: random.Random = None) -> str:
     """Выбрать редкость по весам"""
-    weights = RARITY_WEIGHTS_PREMIUM if is_premium else RARITY_WEIGHTS_FREE
-    roll = random.randint(1, 100)
-    cumulative = 0
-    for rarity, chance in weights.items():
-        cumulative += chance
-        if roll <= cumulative:
-            return rarity
-    return "common"
-
-
-def generate_item_name(theme_id: str, rarity: str) -> tuple[str, str]:
-    """Генерирует уникальное название предмета"""
+    sampler = RARITY_SAMPLER_PREMIUM if is_premium else RARITY_SAMPLER_FREE
+    return sampler.pick((rng or random).random)
+
+
+# ============ ПОТОКИ СЛУЧАЙНОСТИ ============
+def pull_stream_seed(user_id: int, pull_no: int) -> int:
+    """
+    Seed потока для тяги №pull_no игрока: хеш от счётчика, без общего
+    состояния. Любую тягу можно воспроизвести и считать в любом процессе.
+    """
+    digest = hashlib.blake2b(f"{user_id}:{pull_no}".encode(), digest_size=8, person=b"gacha-pull").digest()
+    return int.from_bytes(digest, "big") >> 1
+
+
+def pull_stream(stream_seed: int) -> random.Random:
+    """Независимый генератор для одной тяги"""
+    return random.Random(stream_seed)
+
+
+_MASK64 = (1 << 64) - 1
+
+
+def _seed_uniforms(seed: int, count: int) -> list:
+    """
+    Детерминированные равномерные числа [0, 1) из seed (SplitMix64).
+    Не зависят от глобального random и версии Python.
+    """
+    out = []
+    state = seed & _MASK64
+    for _ in range(count):
+        state = (state + 0x9E3779B97F4A7C15) & _MASK64
+        z = state
+        z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+        z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & _MASK64
+        z ^= z >> 31
+        out.append((z >> 11) * (1.0 / (1 << 53)))
+    return out
+
+
+# ============ ПРЕДМЕТ ============
+@dataclass(slots=True)
+class Item:
+    """
+    Предмет коллекции. Слоты вместо dict — меньше памяти и быстрее
+    доступ к полям, когда в памяти целые паки и коллекции.
+    id и obtained_at есть только у предметов, прочитанных из БД.
+    """
+    unique_id: int
+    seed: int | None
+    name: str
+    description: str
+    rarity: str
+    theme: str
+    theme_name: str
+    power: int
+    luck: float
+    magic: int
+    special_effects: tuple = ()
+    id: int | None = None
+    obtained_at: str | None = None
+
+    @classmethod
+    def from_row(cls, row) -> "Item":
+        """
+        Строка collection (LEFT JOIN collection_legacy) → предмет.
+        Предметы с seed пересобираются, старые берут поля из legacy.
+        """
+        if row["seed"] is not None:
+            item = item_from_seed(row["seed"], row["rarity"], row["theme"], row["unique_id"])
+            item.id = row["id"]
+            item.obtained_at = row["obtained_at"]
+            return item
+        try:
+            effects = tuple(json.loads(row["special_effects"] or "[]"))
+        except ValueError:
+            effects = ()
+        return cls(
+            unique_id=row["unique_id"],
+            seed=None,
+            name=row["name"],
+            description=row["description"],
+            rarity=row["rarity"],
+            theme=row["theme"],
+            theme_name=row["theme_name"],
+            power=row["power"],
+            luck=row["luck"],
+            magic=row["magic"],
+            special_effects=effects,
+            id=row["id"],
+            obtained_at=row["obtained_at"],
+        )
+
+    def to_row(self, user_id: int) -> tuple:
+        """Параметры для INSERT INTO collection (user_id, unique_id, seed, rarity, theme)"""
+        return (user_id, self.unique_id, self.seed, self.rarity, self.theme)
+
+
+def item_from_seed(seed: int, rarity: str, theme_id: str, unique_id: int = None) -> Item:
+    """
+    Восстанавливает предмет из (seed, rarity, theme): название, описание,
+    статы и эффекты всегда получаются одинаковыми. Так предмет хранится в БД.
+    """
     theme = THEMES[theme_id]
-    prefix = random.choice(theme["prefixes"])
-    suffix = random.choice(theme["suffixes"])
-    name = f"{prefix} {suffix}"
-    description = random.choice(theme["descriptions"])
-    return name, description
-
-
-def generate_item_stats(rarity: str) -> dict:
-    """Генерирует статы предмета на основе редкости"""
-    base_multipliers = {
-        "common": 1.0,
-        "uncommon": 1.5,
-        "rare": 2.5,
-        "epic": 4.0,
-        "legendary": 7.0,
-        "mythic": 12.0,
-    }
-    mult = base_multipliers.get(rarity, 1.0)
+    mult = RARITY_MULTIPLIERS.get(rarity, 1.0)
+    u_prefix, u_suffix, u_desc, u_power, u_luck, u_magic, u_effect = _seed_uniforms(seed, 7)
+    prefixes, suffixes, descriptions = theme["prefixes"], theme["suffixes"], theme["descriptions"]
     
-    # Рандомные статы с вариацией ±20%
-    power = random.uniform(0.8, 1.2) * mult * 10
-    luck = random.uniform(0.8, 1.2) * mult * 5
-    magic = random.uniform(0.8, 1.2) * mult * 8
+    special_effects = ()
+    if rarity in ("legendary", "mythic"):
+        special_effects = (SPECIAL_EFFECTS[int(u_effect * len(SPECIAL_EFFECTS))],)
     
-    return {
-        "power": int(power),
-        "luck": round(luck, 1),
-        "magic": int(magic),
-    }
-
-
-def generate_item(theme_id: str = None, rarity: str = None, is_premium: bool = False) -> dict:
+    return Item(
+        unique_id,
+        seed,
+        f"{prefixes[int(u_prefix * len(prefixes))]} {suffixes[int(u_suffix * len(suffixes))]}",
+        descriptions[int(u_desc * len(descriptions))],
+        rarity,
+        theme_id,
+        theme["name"],
+        # Статы с вариацией ±20%
+        int((0.8 + 0.4 * u_power) * mult * 10),
+        round((0.8 + 0.4 * u_luck) * mult * 5, 1),
+        int((0.8 + 0.4 * u_magic) * mult * 8),
+        special_effects,
+    )
+
+
+def generate_item(theme_id: str = None, rarity: str = None, is_premium: bool = False,
+                  rng: random.Random = None) -> Item:
     """
     Генерирует уникальный предмет процедурно.
-    Каждый предмет имеет уникальный ID и статы.
+    Каждый предмет имеет уникальный ID, а всё остальное выводится из seed.
+    rng — поток тяги (по умолчанию глобальный random).
     """
+    rng = rng or random
     if not theme_id:
-        theme_id = random.choice(list(THEMES.keys()))
+        theme_id = rng.choice(THEME_IDS)
     
     if not rarity:
-        rarity = pick_rarity(is_premium)
+        rarity = pick_rarity(is_premium, rng)
     
-    # Генерируем уникальный seed
-    seed = f"{theme_id}_{rarity}_{random.random()}_{random.randint(1000, 9999)}"
-    unique_id = generate_unique_id(seed)
-    
-    name, description = generate_item_name(theme_id, rarity)
-    stats = generate_item_stats(rarity)
-    theme = THEMES[theme_id]
-    
-    # Дополнительные свойства
-    special_effects = []
-    if rarity in ("legendary", "mythic"):
-        effects = ["✨ Светится", "💫 Пульсирует", "🌟 Искрится", "⚡ Энергия", "🔥 Пламя", "❄️ Лёд"]
-        special_effects.append(random.choice(effects))
-    
-    return {
-        "unique_id": unique_id,
-        "name": name,
-        "description": description,
-        "rarity": rarity,
-        "theme": theme_id,
-        "theme_name": theme["name"],
-        "power": stats["power"],
-        "luck": stats["luck"],
-        "magic": stats["magic"],
-        "special_effects": special_effects,
-        "generated_at": None,  # Заполнится в БД
-    }
+    return item_from_seed(rng.getrandbits(63), rarity, theme_id, generate_unique_id())
 
 
-def generate_item_batch(count: int, is_premium: bool = False, theme_id: str = None) -> list:
-    """Генерирует несколько предметов"""
-    items = []
-    for _ in range(count):
-        items.append(generate_item(theme_id=theme_id, is_premium=is_premium))
-    return items
+def generate_item_batch(count: int, is_premium: bool = False, theme_id: str = None,
+                        sampler: RaritySampler = None, rng: random.Random = None) -> list:
+    """
+    Генерирует несколько предметов пакетно.
+    Сначала разом тянутся все случайные величины (редкости, темы, seed'ы
+    и ID), затем из них собираются записи — без вызова generate_item
+    на каждый предмет.
+    Распределения те же, что у generate_item; sampler задаёт веса баннера.
+    """
+    if count <= 0:
+        return []
+    
+    rng = rng or random
+    if sampler is None:
+        sampler = RARITY_SAMPLER_PREMIUM if is_premium else RARITY_SAMPLER_FREE
+    rarities = sampler.sample(count, rng.random)
+    themes = [theme_id] * count if theme_id else rng.choices(THEME_IDS, k=count)
+    seeds = [rng.getrandbits(63) for _ in range(count)]
+    ids = ID_GENERATOR.next_ids(count)
+    
+    return [
+        item_from_seed(seed, rarity, tid, unique_id)
+        for seed, rarity, tid, unique_id in zip(seeds, rarities, themes, ids)
+    ]
 
 
 # ============ ГАЧА ПАКИ ============
@@ -231,26 +426,54 @@ GACHA_PACKS = {
 }
 
 
-def gacha_pull(pack_id: str) -> list:
-    """Выполняет тяги по пакету"""
+def compile_pack_samplers() -> dict:
+    """
+    Строит выборщики редкостей для всех паков. Пак может переопределить
+    часть весов ключом "rarity_weights" (например, лимитированный rate-up).
+    Вызывайте заново после изменения GACHA_PACKS на лету.
+    """
+    samplers = {}
+    for pack_id, pack in GACHA_PACKS.items():
+        base = RARITY_WEIGHTS_PREMIUM if pack.get("is_premium") else RARITY_WEIGHTS_FREE
+        if pack.get("rarity_weights"):
+            samplers[pack_id] = RaritySampler({**base, **pack["rarity_weights"]})
+        else:
+            samplers[pack_id] = RARITY_SAMPLER_PREMIUM if pack.get("is_premium") else RARITY_SAMPLER_FREE
+    PACK_SAMPLERS.clear()
+    PACK_SAMPLERS.update(samplers)
+    return PACK_SAMPLERS
+
+
+PACK_SAMPLERS: dict = {}
+compile_pack_samplers()
+
+
+def pack_item_count(pack_id: str) -> int:
+    """Сколько предметов выдаёт пак (с бонусными)"""
     pack = GACHA_PACKS[pack_id]
-    items = []
-    
-    for _ in range(pack["pulls"]):
-        items.append(generate_item(is_premium=pack.get("is_premium", False)))
+    return pack["pulls"] + pack.get("bonus", 0)
+
+
+def gacha_pull(pack_id: str, rng: random.Random = None) -> list:
+    """
+    Выполняет тяги по пакету.
+    С rng = pull_stream(seed) результат полностью воспроизводим.
+    """
+    pack = GACHA_PACKS[pack_id]
+    sampler = PACK_SAMPLERS[pack_id]
+    items = generate_item_batch(pack["pulls"], sampler=sampler, rng=rng)
     
     # Гарантия (если есть)
     if pack.get("guarantee"):
         guarantee_rarity = pack["guarantee"]
-        has_guaranteed = any(i["rarity"] in ("epic", "legendary", "mythic") for i in items)
+        has_guaranteed = any(i.rarity in ("epic", "legendary", "mythic") for i in items)
         if not has_guaranteed:
             # Заменяем последний предмет на гарантированный
-            items[-1] = generate_item(rarity=guarantee_rarity, is_premium=True)
+            items[-1] = generate_item(rarity=guarantee_rarity, is_premium=True, rng=rng)
     
     # Бонусные тяги
     if pack.get("bonus"):
-        for _ in range(pack["bonus"]):
-            items.append(generate_item(is_premium=True))
+        items.extend(generate_item_batch(pack["bonus"], sampler=sampler, rng=rng))
     
     return items
 
@@ -333,6 +556,25 @@ def generate_daily_quests(count: int = 3) -> list:
     return quests
 
 
+# Какой квест двигает предмет данной редкости
+RARITY_QUEST_TYPES = {
+    "rare": "collect_rare",
+    "epic": "collect_epic",
+    "legendary": "collect_legendary",
+    "mythic": "collect_legendary",
+}
+
+
+def get_quest_events(items: list) -> dict:
+    """Сводит тягу в прогресс квестов: {quest_type: amount}"""
+    events = {"daily_pull": len(items)}
+    for item in items:
+        quest_type = RARITY_QUEST_TYPES.get(item.rarity)
+        if quest_type:
+            events[quest_type] = events.get(quest_type, 0) + 1
+    return events
+
+
 # ============ РЕФЕРАЛЬНАЯ СИСТЕМА ============
 REFERRAL_BONUS = {
     "referrer": {"stars": 10, "gold": 500},  # Тому кто пригласил
@@ -341,33 +583,61 @@ REFERRAL_BONUS = {
 
 
 # ============ ХЕЛПЕРЫ ============
-def format_item_short(item: dict) -> str:
+# Готовые фрагменты текста: эмодзи редкости и строка «редкость • тема»
+RARITY_PREFIX = {rarity: f"{emoji} " for rarity, emoji in RARITY_EMOJI.items()}
+ITEM_HEADERS = {
+    (rarity, theme["name"]): f"📊 {RARITY_NAMES[rarity]} • {theme['name']}"
+    for rarity in RARITIES for theme in THEMES.values()
+}
+
+# Предмет не меняется после генерации — его текст считается один раз
+ITEM_TEXT_CACHE_SIZE = 20000
+_short_text_cache = LRUCache(maxsize=ITEM_TEXT_CACHE_SIZE)
+_full_text_cache = LRUCache(maxsize=ITEM_TEXT_CACHE_SIZE)
+
+
+def get_item_text_cache_stats() -> dict:
+    return {"short": _short_text_cache.stats(), "full": _full_text_cache.stats()}
+
+
+def format_item_short(item: Item) -> str:
     """Короткое описание предмета"""
-    emoji = RARITY_EMOJI.get(item.get("rarity", "common"), "⚪")
-    return f"{emoji} {item.get('name', '???')}"
+    text = _short_text_cache.get(item.unique_id)
+    if text is None:
+        text = f"{RARITY_PREFIX.get(item.rarity, '⚪ ')}{item.name or '???'}"
+        if item.unique_id is not None:
+            _short_text_cache.put(item.unique_id, text)
+    return text
 
 
-def format_item_full(item: dict) -> str:
+def format_item_full(item: Item) -> str:
     """Полное описание предмета"""
-    emoji = RARITY_EMOJI.get(item.get("rarity", "common"), "⚪")
-    rarity_name = RARITY_NAMES.get(item.get("rarity", "common"), "???")
-    theme_name = item.get("theme_name", "???")
+    text = _full_text_cache.get(item.unique_id)
+    if text is not None:
+        return text
+    
+    header = ITEM_HEADERS.get((item.rarity, item.theme_name))
+    if header is None:
+        header = f"📊 {RARITY_NAMES.get(item.rarity, '???')} • {item.theme_name or '???'}"
     
     lines = [
-        f"{emoji} <b>{item.get('name', '???')}</b>",
-        f"📊 {rarity_name} • {theme_name}",
-        f"💪 Сила: {item.get('power', 0)}",
-        f"🍀 Удача: {item.get('luck', 0)}",
-        f"✨ Магия: {item.get('magic', 0)}",
+        f"{RARITY_PREFIX.get(item.rarity, '⚪ ')}<b>{item.name or '???'}</b>",
+        header,
+        f"💪 Сила: {item.power or 0}",
+        f"🍀 Удача: {item.luck or 0}",
+        f"✨ Магия: {item.magic or 0}",
     ]
     
-    if item.get("special_effects"):
-        lines.append(f"🌟 {', '.join(item['special_effects'])}")
+    if item.special_effects:
+        lines.append(f"🌟 {', '.join(item.special_effects)}")
     
-    if item.get("description"):
-        lines.append(f"<i>{item['description']}</i>")
+    if item.description:
+        lines.append(f"<i>{item.description}</i>")
     
-    return "\n".join(lines)
+    text = "\n".join(lines)
+    if item.unique_id is not None:
+        _full_text_cache.put(item.unique_id, text)
+    return text
 
 
 def get_collection_stats(collection: list) -> dict:
@@ -382,13 +652,13 @@ def get_collection_stats(collection: list) -> dict:
     }
     
     for item in collection:
-        rarity = item.get("rarity", "common")
-        theme = item.get("theme", "unknown")
+        rarity = item.rarity
+        theme = item.theme
         
         stats["by_rarity"][rarity] = stats["by_rarity"].get(rarity, 0) + 1
         stats["by_theme"][theme] = stats["by_theme"].get(theme, 0) + 1
-        stats["total_power"] += item.get("power", 0)
-        stats["total_luck"] += item.get("luck", 0)
-        stats["total_magic"] += item.get("magic", 0)
+        stats["total_power"] += item.power or 0
+        stats["total_luck"] += item.luck or 0
+        stats["total_magic"] += item.magic or 0
     
     return stats
@@ -0,0 +1,171 @@
+"""
+📊 Метрики "Бесконечная гача" в текстовом формате Prometheus
+Счётчики, датчики и гистограммы в памяти процесса и эндпоинт /metrics.
+"""
+import time
+
+from aiohttp import web
+
+# Границы гистограмм задержек, секунды
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REGISTRY: list = []
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Gauge:
+    """
+    Текущее значение с метками. fn — функция, которая в момент сбора
+    возвращает {(метки,): значение} (например, из stats() кэша).
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = (), fn=None):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.fn = fn
+        self._values: dict = {}
+        REGISTRY.append(self)
+
+    def set(self, value: float, *labels):
+        self._values[labels] = value
+
+    def collect(self) -> list:
+        values = self.fn() if self.fn is not None else self._values
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+            for labels, value in values.items()
+        ]
+
+
+class Counter(Gauge):
+    """Монотонный счётчик с метками"""
+
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Histogram:
+    """Гистограмма с накопительными корзинами, как у prometheus_client"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        # метки -> [счётчики по корзинам..., сумма, количество]
+        self._series: dict = {}
+        REGISTRY.append(self)
+
+    def observe(self, value: float, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+                break
+        series[-2] += value
+        series[-1] += 1
+
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+    def collect(self) -> list:
+        lines = []
+        for labels, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = _format_labels(self.labelnames, labels, f'le="{_format_value(float(bound))}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            le = _format_labels(self.labelnames, labels, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{le} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {series[-1]}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram: Histogram, labels: tuple):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+
+def render() -> str:
+    """Все метрики в текстовом формате Prometheus 0.0.4"""
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.collect())
+    return "\n".join(lines) + "\n"
+
+
+# ======== HTTP ========
+async def _handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8",
+                        headers={"X-Prometheus-Format": "0.0.4"})
+
+
+def add_metrics_route(app: web.Application, path: str = "/metrics"):
+    app.router.add_get(path, _handle_metrics)
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    """Отдельный aiohttp-сервер только с /metrics; остановка — runner.cleanup()"""
+    app = web.Application()
+    add_metrics_route(app)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+# ======== МЕТРИКИ БОТА ========
+UPDATE_LATENCY = Histogram(
+    "gacha_update_seconds", "Полная обработка апдейта", ("update_type",))
+HANDLER_LATENCY = Histogram(
+    "gacha_handler_seconds", "Время работы обработчика", ("handler",))
+HANDLER_ERRORS = Counter(
+    "gacha_handler_errors_total", "Исключения в обработчиках", ("handler", "error"))
+
+DB_QUERY_LATENCY = Histogram(
+    "gacha_db_query_seconds", "Время выполнения запроса к БД", ("query",))
+DB_QUERY_ERRORS = Counter(
+    "gacha_db_query_errors_total", "Запросы к БД, завершившиеся ошибкой", ("query",))
+DB_SLOW_QUERIES = Counter(
+    "gacha_db_slow_queries_total", "Запросы к БД дольше порога журнала", ("query",))
+DB_POOL_WAIT = Histogram(
+    "gacha_db_pool_wait_seconds", "Ожидание соединения из пула", ("role",))
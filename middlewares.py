@@ -0,0 +1,131 @@
+"""
+🧩 Middleware диспетчера "Бесконечная гача"
+"""
+import asyncio
+import logging
+
+from aiogram import BaseMiddleware
+from aiogram.exceptions import TelegramAPIError
+
+from metrics import HANDLER_ERRORS, HANDLER_LATENCY, UPDATE_LATENCY
+
+logger = logging.getLogger(__name__)
+
+
+class ConcurrencyLimitMiddleware(BaseMiddleware):
+    """
+    Не больше limit апдейтов в обработке одновременно, остальные ждут.
+    Регистрируется после UserSerializationMiddleware: слот занимает только
+    апдейт, дошедший до обработки, а не ждущий своей очереди у игрока.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._semaphore = asyncio.Semaphore(limit)
+
+    async def __call__(self, handler, event, data):
+        async with self._semaphore:
+            return await handler(event, data)
+
+
+class _UserSlot:
+    __slots__ = ("lock", "pending", "callbacks")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.pending = 0
+        self.callbacks = set()
+
+
+class UserSerializationMiddleware(BaseMiddleware):
+    """
+    Апдейты одного игрока обрабатываются строго по очереди.
+    Нажатие с той же callback_data, пока такое же ещё в обработке или
+    в очереди, схлопывается (двойной тап по «пак 100» или «забрать»).
+    Если у игрока уже max_pending апдейтов, новые отбрасываются,
+    чтобы один спамер не занял цикл событий и писателя БД.
+    Платежи (successful_payment и pre_checkout_query) только встают
+    в очередь и никогда не отбрасываются: за ними стоят деньги игрока.
+    """
+
+    def __init__(self, max_pending: int = 3):
+        self.max_pending = max_pending
+        self.coalesced = 0
+        self.dropped = 0
+        self._slots: dict = {}
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+        
+        callback = getattr(event, "callback_query", None)
+        key = callback.data if callback is not None else None
+        slot = self._slots.get(user.id)
+        if slot is None:
+            slot = self._slots[user.id] = _UserSlot()
+        
+        if key is not None and key in slot.callbacks:
+            self.coalesced += 1
+            await self._release(data["bot"], callback)
+            return None
+        if slot.pending >= self.max_pending and not self._is_payment(event):
+            self.dropped += 1
+            await self._release(data["bot"], callback)
+            return None
+        
+        slot.pending += 1
+        if key is not None:
+            slot.callbacks.add(key)
+        try:
+            async with slot.lock:
+                return await handler(event, data)
+        finally:
+            slot.pending -= 1
+            slot.callbacks.discard(key)
+            if not slot.pending:
+                del self._slots[user.id]
+
+    @staticmethod
+    def _is_payment(event) -> bool:
+        if event.pre_checkout_query is not None:
+            return True
+        return event.message is not None and event.message.successful_payment is not None
+
+    @staticmethod
+    async def _release(bot, callback):
+        """Снимает «часики» с кнопки отброшенного нажатия"""
+        if callback is None:
+            return
+        try:
+            await bot.answer_callback_query(callback.id)
+        except TelegramAPIError as e:
+            logger.debug(f"Не удалось ответить на отброшенное нажатие: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self._slots),
+            "coalesced": self.coalesced,
+            "dropped": self.dropped,
+        }
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Внешний middleware апдейтов: полное время обработки по типу апдейта"""
+
+    async def __call__(self, handler, event, data):
+        with UPDATE_LATENCY.time(event.event_type):
+            return await handler(event, data)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Внутренний middleware: время и ошибки каждого обработчика по имени"""
+
+    async def __call__(self, handler, event, data):
+        name = data["handler"].callback.__name__
+        try:
+            with HANDLER_LATENCY.time(name):
+                return await handler(event, data)
+        except Exception as e:
+            HANDLER_ERRORS.inc(name, type(e).__name__)
+            raise
@@ -0,0 +1,251 @@
+"""
+📤 Исходящая очередь Telegram "Бесконечная гача"
+Все запросы к Bot API, адресованные чатам, идут через одну очередь:
+токен-бакеты (общий и на каждый чат), полосы приоритета и повтор после 429.
+Подключается как middleware сессии бота, поэтому обработчики по-прежнему
+вызывают answer/edit_text/send_message как обычно.
+"""
+import asyncio
+import contextvars
+import itertools
+import logging
+import time
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramAPIError, TelegramRetryAfter
+from aiogram.methods import AnswerCallbackQuery, AnswerPreCheckoutQuery
+
+from cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Полосы приоритета: меньше — раньше
+LANE_ANSWER = 0       # ответы на нажатия и платежи — Telegram ждёт их считанные секунды
+LANE_INTERACTIVE = 1  # ответ игроку на его действие
+LANE_BULK = 2         # уведомления, которые никто не ждёт
+LANE_NAMES = ("answer", "interactive", "bulk")
+
+_lane = contextvars.ContextVar("outbound_lane", default=LANE_INTERACTIVE)
+
+
+class TokenBucket:
+    """Токен-бакет: rate токенов в секунду, не больше capacity разом"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated", "blocked_until")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def delay(self, now: float) -> float:
+        """Сколько ждать до свободного токена (0 — можно сейчас)"""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def block(self, until: float):
+        """Telegram попросил подождать (429) — до until токенов нет"""
+        self.blocked_until = max(self.blocked_until, until)
+
+
+class _Job:
+    __slots__ = ("make_request", "bot", "method", "future", "lane", "seq", "chat_id", "enqueued_at", "attempts")
+
+    def __init__(self, make_request, bot, method, lane: int, seq: int):
+        self.make_request = make_request
+        self.bot = bot
+        self.method = method
+        self.future = asyncio.get_running_loop().create_future()
+        self.lane = lane
+        self.seq = seq
+        self.chat_id = getattr(method, "chat_id", None)
+        self.enqueued_at = time.monotonic()
+        self.attempts = 0
+
+
+class SendQueue(BaseRequestMiddleware):
+    """
+    Очередь исходящих запросов.
+    global_rate — запросов в секунду на бота, chat_rate/chat_burst — на личный
+    чат, group_rate — на группу (None — без ограничения). Служебные методы
+    (getUpdates, setWebhook, …) и любые запросы до start() идут мимо очереди.
+    """
+
+    def __init__(self, global_rate: float | None = 30, chat_rate: float | None = 1, chat_burst: int = 3,
+                 group_rate: float | None = 20 / 60, workers: int = 8, max_retries: int = 3):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.workers = workers
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, global_rate) if global_rate else None
+        self._chats = LRUCache(maxsize=50000)
+        self._queue: asyncio.PriorityQueue | None = None
+        self._seq = itertools.count()
+        self._tasks: list = []
+        self._background: set = set()
+        self._deferred: dict = {}  # seq -> (таймер, запрос), ждущие возврата в очередь
+        # Метрики
+        self.queued = [0] * len(LANE_NAMES)
+        self.sent = 0
+        self.retries = 0
+        self.failed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    # ---- middleware ----
+    async def __call__(self, make_request, bot, method):
+        lane = self._lane_for(method)
+        if lane is None or self._queue is None:
+            return await make_request(bot, method)
+        job = _Job(make_request, bot, method, lane, next(self._seq))
+        self.queued[lane] += 1
+        self._queue.put_nowait((lane, job.seq, job))
+        return await job.future
+
+    @staticmethod
+    def _lane_for(method) -> int | None:
+        if isinstance(method, (AnswerCallbackQuery, AnswerPreCheckoutQuery)):
+            return LANE_ANSWER
+        if getattr(method, "chat_id", None) is None:
+            return None
+        return _lane.get()
+
+    def _chat_bucket(self, chat_id) -> TokenBucket | None:
+        is_group = isinstance(chat_id, str) or chat_id < 0
+        rate = self.group_rate if is_group else self.chat_rate
+        if not rate:
+            return None
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(rate, 1 if is_group else self.chat_burst)
+            self._chats.put(chat_id, bucket)
+        return bucket
+
+    def _defer(self, job: _Job, delay: float):
+        """Вернуть запрос в очередь через delay секунд, не занимая воркер"""
+        handle = asyncio.get_running_loop().call_later(delay, self._requeue, job)
+        self._deferred[job.seq] = (handle, job)
+
+    def _requeue(self, job: _Job):
+        del self._deferred[job.seq]
+        self._queue.put_nowait((job.lane, job.seq, job))
+
+    # ---- воркеры ----
+    async def _worker(self):
+        while True:
+            _, _, job = await self._queue.get()
+            if job.future.done():  # вызывающий уже не ждёт
+                continue
+            try:
+                await self._process(job)
+            except Exception as e:
+                # Сбой одного запроса не должен уносить воркер
+                logger.exception(f"Ошибка исходящей очереди на {type(job.method).__name__}")
+                self.failed += 1
+                if not job.future.done():
+                    job.future.set_exception(e)
+
+    async def _process(self, job: _Job):
+        chat = None
+        if job.chat_id is not None and job.lane != LANE_ANSWER:
+            chat = self._chat_bucket(job.chat_id)
+            wait = chat.delay(time.monotonic()) if chat else 0
+            if wait > 0:
+                self._defer(job, wait)
+                return
+        if self._global is not None:
+            while (wait := self._global.delay(time.monotonic())) > 0:
+                await asyncio.sleep(wait)
+            self._global.take()
+        if chat is not None:
+            chat.take()
+
+        if not job.attempts:
+            waited = time.monotonic() - job.enqueued_at
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+        try:
+            result = await job.make_request(job.bot, job.method)
+        except TelegramRetryAfter as e:
+            self.retries += 1
+            if job.attempts >= self.max_retries:
+                self.failed += 1
+                if not job.future.done():
+                    job.future.set_exception(e)
+                return
+            job.attempts += 1
+            # Лимит чата — ждёт только этот чат, иначе притормаживаем всех
+            bucket = chat if chat is not None else self._global
+            if bucket is not None:
+                bucket.block(time.monotonic() + e.retry_after)
+            logger.warning(f"429 на {type(job.method).__name__}, повтор через {e.retry_after} с")
+            self._defer(job, e.retry_after)
+        except Exception as e:
+            self.failed += 1
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            self.sent += 1
+            if not job.future.done():
+                job.future.set_result(result)
+
+    def start(self):
+        if self._queue is None:
+            self._queue = asyncio.PriorityQueue()
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """Останавливает воркеры; запросы после этого идут напрямую"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        queue, self._queue = self._queue, None
+        while queue is not None and not queue.empty():
+            _, _, job = queue.get_nowait()
+            job.future.cancel()
+        # Отложенные после 429 или лимита чата тоже больше никто не отправит
+        for handle, job in self._deferred.values():
+            handle.cancel()
+            job.future.cancel()
+        self._deferred.clear()
+
+    # ---- уведомления ----
+    def notify(self, bot: Bot, chat_id: int, text: str, **kwargs) -> asyncio.Task:
+        """Фоновое сообщение в полосе LANE_BULK: обработчик его не ждёт"""
+        async def _send():
+            _lane.set(LANE_BULK)
+            try:
+                await bot.send_message(chat_id, text, **kwargs)
+            except TelegramAPIError as e:
+                logger.warning(f"Не удалось отправить уведомление {chat_id}: {e}")
+
+        task = asyncio.create_task(_send())
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        return task
+
+    def stats(self) -> dict:
+        processed = self.sent + self.failed
+        return {
+            "depth": self._queue.qsize() if self._queue is not None else 0,
+            "queued": dict(zip(LANE_NAMES, self.queued)),
+            "sent": self.sent,
+            "retries": self.retries,
+            "failed": self.failed,
+            "wait_avg_ms": round(self.wait_total / processed * 1000, 1) if processed else 0.0,
+            "wait_max_ms": round(self.wait_max * 1000, 1),
+        }
@@ -0,0 +1,57 @@
+"""
+📜 Движок ежедневных квестов "Бесконечная гача"
+Квесты игрока на день загружаются один раз и держатся в памяти,
+проиндексированные по типу. События оцениваются без обращения к БД —
+наружу отдаются только квесты, у которых реально изменился прогресс.
+"""
+
+# Прогресс этих квестов — текущее значение (размер коллекции, покрытие тем),
+# а не сумма событий
+ABSOLUTE_QUEST_TYPES = {"collection_size", "theme_complete"}
+
+
+class QuestBook:
+    """Квесты игрока за один день"""
+
+    __slots__ = ("date", "quests", "by_type")
+
+    def __init__(self, date: str, quests: list):
+        self.date = date
+        self.quests = quests
+        self.by_type = {}
+        for q in quests:
+            self.by_type.setdefault(q["quest_type"], []).append(q)
+
+    def active(self, quest_type: str) -> list:
+        """Невыполненные квесты данного типа"""
+        return [q for q in self.by_type.get(quest_type, ()) if not q["is_completed"] and not q["is_claimed"]]
+
+    def wants(self, quest_type: str) -> bool:
+        return bool(self.active(quest_type))
+
+    def evaluate(self, events: dict) -> list:
+        """
+        events — {quest_type: значение}: прирост для обычных типов,
+        текущее значение для ABSOLUTE_QUEST_TYPES.
+        Возвращает изменения [(квест, прогресс, выполнен)], книгу не меняет.
+        """
+        changes = []
+        for quest_type, value in events.items():
+            for q in self.active(quest_type):
+                base = 0 if quest_type in ABSOLUTE_QUEST_TYPES else q["progress"]
+                progress = min(base + value, q["target"])
+                if progress > q["progress"]:
+                    changes.append((q, progress, int(progress >= q["target"])))
+        return changes
+
+    @staticmethod
+    def apply(changes: list):
+        """Применяет изменения к квестам в памяти (после коммита)"""
+        for q, progress, completed in changes:
+            q["progress"] = progress
+            q["is_completed"] = completed
+
+    def claim(self, quest_id: int):
+        for q in self.quests:
+            if q["id"] == quest_id:
+                q["is_claimed"] = 1
@@ -0,0 +1,113 @@
+"""
+🧺 Резерв заранее сгенерированных тяг "Бесконечная гача"
+Фоновая задача держит для каждого пака запас готовых предметов
+(с уже отрисованным текстом), а обработчик тяги только забирает их.
+"""
+import asyncio
+import logging
+import secrets
+from collections import deque
+from dataclasses import dataclass
+
+from gacha_data import GACHA_PACKS, Item, format_item_full, format_item_short, gacha_pull, pull_stream
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(slots=True)
+class PreparedPull:
+    """Готовая тяга: поток, из которого она получена, предметы и их текст"""
+    stream_seed: int
+    items: list[Item]
+    text: str
+
+
+def render_items(items: list) -> str:
+    """Блок предметов для сообщения о тяге"""
+    if len(items) == 1:
+        return format_item_full(items[0])
+    lines = [f"<b>Получено {len(items)} предметов:</b>\n"]
+    lines.extend(format_item_short(item) for item in items)
+    return "\n".join(lines)
+
+
+def prepare_pull(pack_id: str) -> PreparedPull:
+    """
+    Генерирует тягу из собственного потока. stream_seed пишется в журнал
+    тяг, поэтому такие тяги тоже воспроизводятся через replay_pull.
+    """
+    stream_seed = secrets.randbits(63)
+    items = gacha_pull(pack_id, rng=pull_stream(stream_seed))
+    return PreparedPull(stream_seed, items, render_items(items))
+
+
+class ItemReservoir:
+    """
+    Запасы готовых тяг по пакам.
+    sizes — сколько тяг держать для каждого пака (0 — не держать),
+    refill_batch — сколько тяг пака догенерировать за один проход,
+    refill_interval — пауза между проходами, сек.
+    Скорость пополнения — refill_batch / refill_interval тяг в секунду на пак.
+    """
+
+    def __init__(self, sizes: dict, refill_batch: int = 10, refill_interval: float = 0.5):
+        self.sizes = {pack_id: sizes.get(pack_id, 0) for pack_id in GACHA_PACKS}
+        self.refill_batch = refill_batch
+        self.refill_interval = refill_interval
+        self.hits = 0
+        self.misses = 0
+        self._pools = {pack_id: deque() for pack_id in GACHA_PACKS}
+        self._task: asyncio.Task | None = None
+
+    def take(self, pack_id: str) -> PreparedPull:
+        """Готовая тяга из запаса; если запас пуст — генерируется на месте"""
+        pool = self._pools[pack_id]
+        if pool:
+            self.hits += 1
+            return pool.popleft()
+        self.misses += 1
+        return prepare_pull(pack_id)
+
+    def give_back(self, pack_id: str, prepared: PreparedPull):
+        """Возвращает невыданную тягу (например, не хватило валюты)"""
+        self._pools[pack_id].appendleft(prepared)
+
+    async def refill(self) -> int:
+        """Один проход пополнения. Возвращает число сгенерированных тяг"""
+        generated = 0
+        for pack_id, size in self.sizes.items():
+            pool = self._pools[pack_id]
+            for _ in range(min(self.refill_batch, size - len(pool))):
+                pool.append(prepare_pull(pack_id))
+                generated += 1
+                # Отдаём цикл событий после каждой тяги — обработчики не ждут
+                await asyncio.sleep(0)
+        return generated
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refill()
+            except Exception:
+                logger.exception("Ошибка пополнения резерва тяг")
+            await asyncio.sleep(self.refill_interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "sizes": {pack_id: len(pool) for pack_id, pool in self._pools.items()},
+            "hits": self.hits,
+            "misses": self.misses,
+        }
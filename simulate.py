@@ -0,0 +1,155 @@
+"""
+📈 Монте-Карло симулятор экономики "Бесконечная гача"
+Гоняет паки через настоящие функции gacha_data и считает:
+скорость генерации, гистограмму редкостей, частоту гарантий
+и ожидаемую цену легендарки/мифика в Stars.
+
+    python simulate.py --pulls 1000000 --packs pack_10 pack_100 --workers 8
+"""
+import argparse
+import json
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from gacha_data import (
+    GACHA_PACKS, RARITIES, RARITY_NAMES,
+    gacha_pull, pull_stream, pull_stream_seed,
+)
+
+CHUNK_SIZE = 2000
+
+
+RARITY_RANK = {rarity: n for n, rarity in enumerate(RARITIES)}
+
+
+def _simulate_chunk(pack_id: str, pulls: int, seed: int, chunk_no: int) -> dict:
+    """Прогон части паков в отдельном процессе — свой поток случайности"""
+    pack = GACHA_PACKS[pack_id]
+    rng = pull_stream(pull_stream_seed(seed, chunk_no))
+    guarantee = pack.get("guarantee")
+    guarantee_rank = RARITY_RANK[guarantee] if guarantee else None
+    epic_rank = RARITY_RANK["epic"]
+    base = pack["pulls"]
+
+    rarities = Counter()
+    guarantee_hits = 0
+    guarantee_hits_base = 0
+    epic_plus_base = 0
+    items_total = 0
+
+    started = time.perf_counter()
+    for _ in range(pulls):
+        items = gacha_pull(pack_id, rng=rng)
+        items_total += len(items)
+        names = [i.rarity for i in items]
+        ranks = [RARITY_RANK[r] for r in names]
+        rarities.update(names)
+        if guarantee_rank is not None:
+            if max(ranks) >= guarantee_rank:
+                guarantee_hits += 1
+            if max(ranks[:base]) >= guarantee_rank:
+                guarantee_hits_base += 1
+            if max(ranks[:base]) >= epic_rank:
+                epic_plus_base += 1
+    elapsed = time.perf_counter() - started
+
+    return {
+        "pulls": pulls,
+        "items": items_total,
+        "seconds": elapsed,
+        "rarities": dict(rarities),
+        "guarantee_hits": guarantee_hits,
+        "guarantee_hits_base": guarantee_hits_base,
+        "epic_plus_base": epic_plus_base,
+    }
+
+
+def simulate_pack(pack_id: str, pulls: int, workers: int, seed: int) -> dict:
+    """Симулирует pulls открытий пака на пуле процессов"""
+    chunks = [CHUNK_SIZE] * (pulls // CHUNK_SIZE)
+    if pulls % CHUNK_SIZE:
+        chunks.append(pulls % CHUNK_SIZE)
+
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        parts = list(pool.map(
+            _simulate_chunk,
+            [pack_id] * len(chunks), chunks, [seed] * len(chunks), range(len(chunks)),
+        ))
+    wall = time.perf_counter() - started
+
+    rarities = Counter()
+    for part in parts:
+        rarities.update(part["rarities"])
+    items = sum(p["items"] for p in parts)
+    pack = GACHA_PACKS[pack_id]
+    legendary_plus = rarities["legendary"] + rarities["mythic"]
+    stars_spent = pack["cost_stars"] * pulls
+
+    result = {
+        "pack_id": pack_id,
+        "pulls": pulls,
+        "items": items,
+        "wall_seconds": round(wall, 3),
+        "items_per_sec": round(items / wall) if wall else None,
+        "items_per_cpu_sec": round(items / sum(p["seconds"] for p in parts)) if items else None,
+        "rarities": {r: rarities[r] for r in RARITIES},
+        "rarity_share": {r: rarities[r] / items for r in RARITIES} if items else {},
+        "stars_per_legendary_plus": stars_spent / legendary_plus if legendary_plus and stars_spent else None,
+        "stars_per_mythic": stars_spent / rarities["mythic"] if rarities["mythic"] and stars_spent else None,
+    }
+    if pack.get("guarantee"):
+        result["guarantee"] = pack["guarantee"]
+        result["guarantee_hit_rate"] = sum(p["guarantee_hits"] for p in parts) / pulls
+        result["guarantee_hit_rate_base"] = sum(p["guarantee_hits_base"] for p in parts) / pulls
+        result["epic_plus_rate_base"] = sum(p["epic_plus_base"] for p in parts) / pulls
+    return result
+
+
+def format_result(r: dict) -> str:
+    pack = GACHA_PACKS[r["pack_id"]]
+    lines = [
+        f"{pack['name']} ({r['pack_id']}) — {r['pulls']} открытий, {r['items']} предметов",
+        f"  ⏱ {r['wall_seconds']} с, {r['items_per_sec']} предм./с "
+        f"({r['items_per_cpu_sec']} предм./с на процесс)",
+    ]
+    for rarity in RARITIES:
+        share = r["rarity_share"].get(rarity, 0)
+        lines.append(f"  {RARITY_NAMES[rarity]:<12} {r['rarities'][rarity]:>12}  {share:8.4%}")
+    if "guarantee" in r:
+        lines.append(
+            f"  🎯 Гарантия «{RARITY_NAMES[r['guarantee']]}»: {r['guarantee_hit_rate']:.4%} паков "
+            f"(без бонусных: {r['guarantee_hit_rate_base']:.4%}, эпик+ в основных: {r['epic_plus_rate_base']:.4%})"
+        )
+    if r["stars_per_legendary_plus"]:
+        lines.append(f"  💎 Stars за легендарный+: {r['stars_per_legendary_plus']:.1f}")
+    if r["stars_per_mythic"]:
+        lines.append(f"  💎 Stars за мифический: {r['stars_per_mythic']:.1f}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Симуляция экономики и бенчмарк генерации")
+    parser.add_argument("--pulls", type=int, default=100_000, help="открытий каждого пака")
+    parser.add_argument("--packs", nargs="+", default=list(GACHA_PACKS), choices=list(GACHA_PACKS))
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--seed", type=int, default=0, help="seed прогона (воспроизводимость)")
+    parser.add_argument("--json", metavar="PATH", help="сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    results = []
+    for pack_id in args.packs:
+        result = simulate_pack(pack_id, args.pulls, args.workers, args.seed)
+        results.append(result)
+        print(format_result(result), end="\n\n", flush=True)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"seed": args.seed, "workers": args.workers, "results": results},
+                      f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
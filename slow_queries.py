@@ -0,0 +1,157 @@
+"""
+🐢 Журнал медленных запросов "Бесконечная гача"
+Запросы дольше порога пишутся в лог вместе с формой параметров (типы,
+без значений). Для каждого такого запроса один раз снимается
+EXPLAIN QUERY PLAN, а раз в интервал в лог уходит топ самых дорогих.
+"""
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# План снимается только для запросов, у которых он есть
+EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "REPLACE", "WITH")
+
+
+def params_shape(parameters) -> str:
+    """Форма параметров: типы без значений (в параметрах — данные игроков)"""
+    if parameters is None:
+        return "()"
+    if isinstance(parameters, dict):
+        return "{" + ", ".join(f"{k}: {type(v).__name__}" for k, v in parameters.items()) + "}"
+    return "(" + ", ".join(type(v).__name__ for v in parameters) + ")"
+
+
+def many_shape(parameters) -> str:
+    """Форма параметров executemany: число строк и форма первой"""
+    if not isinstance(parameters, (list, tuple)):
+        return "поток строк"
+    if not parameters:
+        return "0 строк"
+    return f"{len(parameters)} × {params_shape(parameters[0])}"
+
+
+def is_full_scan(detail: str) -> bool:
+    """SCAN без индекса — полный проход по таблице"""
+    return detail.startswith("SCAN ") and " USING " not in detail
+
+
+class _SlowQuery:
+    __slots__ = ("label", "count", "total", "max", "shape", "plan")
+
+    def __init__(self, label: str):
+        self.label = label
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.shape = ""
+        self.plan: list | None = None
+
+    @property
+    def full_scan(self) -> bool:
+        return any(is_full_scan(detail) for detail in self.plan or ())
+
+    @property
+    def plan_kind(self) -> str:
+        """Кратко о плане для сводки: полный проход, по индексам или неизвестен"""
+        if self.plan is None:
+            return "без плана"
+        return "SCAN" if self.full_scan else "индекс"
+
+
+class SlowQueryLog:
+    """
+    threshold — порог в секундах (0 — журнал выключен),
+    top — сколько запросов в периодической сводке.
+    """
+
+    def __init__(self, threshold: float = 0.1, top: int = 10):
+        self.threshold = threshold
+        self.top = top
+        self.total = 0
+        self._queries: dict = {}  # текст запроса -> _SlowQuery
+        self._planned: set = set()
+        self._task: asyncio.Task | None = None
+
+    def is_slow(self, seconds: float) -> bool:
+        return bool(self.threshold) and seconds >= self.threshold
+
+    def needs_plan(self, sql: str) -> bool:
+        """
+        True один раз на запрос, у которого бывает план: вызывающий
+        снимает его сам, параллельные медленные вызовы уже не снимают.
+        """
+        if sql in self._planned or not sql.lstrip().upper().startswith(EXPLAINABLE):
+            return False
+        self._planned.add(sql)
+        return True
+
+    def record(self, sql: str, label: str, seconds: float, shape: str, plan: list | None = None):
+        query = self._queries.get(sql)
+        if query is None:
+            query = self._queries[sql] = _SlowQuery(label)
+        query.count += 1
+        query.total += seconds
+        query.max = max(query.max, seconds)
+        query.shape = shape
+        self.total += 1
+        logger.warning(f"🐢 Медленный запрос {seconds * 1000:.1f} мс: {label} — параметры {shape}")
+        if plan:
+            query.plan = plan
+            logger.warning(f"🐢 План «{label}»:\n" + "\n".join(f"    {detail}" for detail in plan))
+            if query.full_scan:
+                logger.warning(f"🐢 Полный проход таблицы в «{label}»")
+
+    # ---- сводка ----
+    def summary(self) -> list:
+        """Топ запросов по суммарному времени сверх порога"""
+        queries = sorted(self._queries.values(), key=lambda q: q.total, reverse=True)
+        return [
+            {
+                "query": q.label,
+                "count": q.count,
+                "total_ms": round(q.total * 1000, 1),
+                "avg_ms": round(q.total / q.count * 1000, 1),
+                "max_ms": round(q.max * 1000, 1),
+                "params": q.shape,
+                "full_scan": q.full_scan,
+                "plan": q.plan_kind,
+            }
+            for q in queries[:self.top]
+        ]
+
+    def log_summary(self):
+        rows = self.summary()
+        if not rows:
+            return
+        lines = [
+            f"{n}. {r['total_ms']} мс за {r['count']} раз (ср. {r['avg_ms']}, макс. {r['max_ms']}) "
+            f"[{r['plan']}] — {r['query']} {r['params']}"
+            for n, r in enumerate(rows, 1)
+        ]
+        logger.warning(f"🐢 Топ медленных запросов ({self.total} всего):\n" + "\n".join(lines))
+
+    async def _run(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            self.log_summary()
+
+    def start(self, interval: float):
+        if self._task is None and self.threshold and interval:
+            self._task = asyncio.create_task(self._run(interval))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "total": self.total,
+            "statements": len(self._queries),
+            "full_scans": sum(1 for q in self._queries.values() if q.full_scan),
+        }